@@ -8,143 +8,245 @@ July 2024
 
 from __future__ import annotations
 
+import asyncio
 import logging
 import voluptuous as vol
 
 from homeassistant.core import HomeAssistant, ServiceCall, SupportsResponse, ServiceResponse, callback # type: ignore
+from homeassistant.exceptions import ServiceValidationError               # type: ignore
+from homeassistant.helpers import config_validation as cv                # type: ignore
+from homeassistant.helpers.service import async_extract_config_entry_ids # type: ignore
+from homeassistant.helpers.storage import Store                          # type: ignore
 from homeassistant.helpers.typing import ConfigType # type: ignore
 from homeassistant import config_entries            # type: ignore
 
 from .const import *
 from .inverter import InverterCoordinator
-from .path import POST_REQUESTS
+from .path import GET_REQUESTS, KEY_REQUIRES, POST_REQUESTS
+from .scheduler import FleetScheduler
+from .fleet import FleetAggregate
+from .session import SessionPool
+from .capabilities import CapabilityCache
 
 _LOGGER = logging.getLogger(__name__)
 PLATFORMS = ["text", "sensor"]
+FLEET_PLATFORMS = ["sensor"]
+
+# Optional YAML configuration, shared by every inverter
+CONFIG_SCHEMA = vol.Schema({
+    vol.Optional(DOMAIN): vol.Schema({
+        vol.Optional("max_in_flight", default=FLEET_MAX_IN_FLIGHT): vol.All(int, vol.Range(min=1)),
+        vol.Optional("jitter", default=FLEET_JITTER): vol.All(vol.Coerce(float), vol.Range(min=0)),
+        vol.Optional("record", default=False): cv.boolean, # Capture raw polls for offline replay
+    })
+}, extra=vol.ALLOW_EXTRA)
+
+# Services target inverters by device, area or config entry
+TARGET_SCHEMA = {
+    **cv.TARGET_SERVICE_FIELDS,
+    vol.Optional("entry_id"): vol.All(cv.ensure_list, [str]),
+}
 
 # __INIT__ #
 async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     """
     Load the integration into HASSOS (asynchronous). 
     
-    This function recovers config entries and for each one create 
-    the HUB instances needed to update data. It then updates config 
-    entries accordingly. Also creates services actions for each
-    entry created (those are named dynamically).
-
-    Services provided for each inverter : 
-        inverter_mode  : <str> (smg | bup | ong | ofg) 
-        mppt           : [<int>, <int>]
-        feed_in        : <bool>
-        injection_power: <int>
-        lcd_time       : <int>
-        night_discharge: <bool>
-        grid_charge    : <bool>
-        relay          : <bool>
-        ac_output      : <bool>
-        smartload      : read-only, no input
+    This function registers a single set of services shared by every
+    inverter, each call targeting one or several inverters (by device,
+    area or config entry). HUBs are only created when their config
+    entry is set up (see async_setup_entry).
+
+    Services provided for targeted inverters : 
+        set_inverter_mode  : <str> (smg | bup | ong | ofg) 
+        set_mppt           : [<int>, <int>]
+        set_feed_in        : <bool>
+        set_injection_power: <int>
+        set_lcd_time       : <int>
+        set_night_discharge: <bool>
+        set_grid_charge    : <bool>
+        set_relay          : <bool>
+        set_ac_output      : <bool>
+        get_smartload      : read-only, optional <int> since_version
+        burst              : optional [<str>] keys, <float> interval, <float> duration
+        probe_capabilities : forget the capability profile, probe it again
+
+    Also provides a single 'fleet_timing' service returning the timing
+    of the last polling cycles of every inverter.
     """
 
-    # Re-instanciate HUBs and services on startup
-    entries = hass.config_entries.async_entries(DOMAIN)
-
-    for entry in entries:
-        # Create the corresponding HUB
-        data = {
-            "address"  : entry.data.get("address", ""),
-            "username" : entry.data.get("username", ""),
-            "password" : entry.data.get("password", "")
-        }
-        IC = InverterCoordinator(hass, data, entry.entry_id, entry.title)
-
-        hass.data.setdefault(DOMAIN, {})[entry.entry_id] = IC
-
-        # Define services for each inverter
-        for service_name, service_data in POST_REQUESTS.items():
-
-            friendly_name: str = service_data.get('friendly_name')
-            description: str = service_data.get('description')
-            values: dict = service_data.get('fields')
-
-            # Build the input schema with default values and limitations
-            vol_dict = {'description': description}
-            for value_name, value_data in values.items():
-                vol_dict[vol.Required(value_name, 
-                                      default=value_data.get("example"), 
-                                      )] = value_data.get("type", str)
-            schema = vol.Schema(vol_dict)
-
-            # Create each service handler using default arguments
-            # This allows each handler to use different field values despite being the 'same' method
-            @callback
-            async def service_handler(call: ServiceCall, 
-                                      entry_title=entry.title, 
-                                      service_name=service_name,
-                                      values=values,
-                                      IC_uuid = entry.entry_id) -> ServiceResponse:
-                """Redirect service call to the correct API method and build payload."""
-
-                # Recover Inverter from UUID then get api call
-                IC = InverterCoordinator.get_from_id(IC_uuid)
-                api_call = getattr(IC.api, f"set_{service_name}")
+    # Fleet scheduler must exist before any HUB uses it
+    options = dict(config.get(DOMAIN, {}))
+    hass.data[CAPTURE_KEY] = options.pop("record", False)
+    scheduler = FleetScheduler.get(hass, **options)
+
+    @callback
+    async def fleet_timing_handler(call: ServiceCall) -> ServiceResponse:
+        """Return the timing of the last polling cycles."""
+        return scheduler.stats()
+
+    hass.services.async_register(DOMAIN, "fleet_timing", fleet_timing_handler,
+                                 supports_response=SupportsResponse.ONLY)
+
+    # Define services shared by every inverter
+    for service_name, service_data in POST_REQUESTS.items():
+
+        values: dict = service_data.get('fields')
+
+        # Build the input schema with default values and limitations
+        vol_dict = dict(TARGET_SCHEMA)
+        for value_name, value_data in values.items():
+            vol_dict[vol.Required(value_name, 
+                                  default=value_data.get("example"), 
+                                  )] = value_data.get("type", str)
+        schema = vol.Schema(vol_dict)
+
+        # Create each service handler using default arguments
+        # This allows each handler to use different field values despite being the 'same' method
+        @callback
+        async def service_handler(call: ServiceCall, 
+                                  service_name=service_name,
+                                  values=values,
+                                  setting=service_data.get('input'),
+                                  refresh=service_data.get('refresh', []),
+                                  requires=service_data.get('requires')) -> ServiceResponse:
+            """Send the change to every targeted inverter at the same time."""
+
+            # Build request payload
+            # Several fields are sent together as a list (e.g. MPPT range)
+            args = [call.data.get(value_name) for value_name in values.keys()]
+            value = args[0] if len(args) == 1 else args
+
+            async def set_one(IC: InverterCoordinator) -> dict:
+                if not IC.supports(requires): # Don't wait for a timeout
+                    return {"result": 'unsupported'}
                 response = {"result": 'failed'}
-                
-                # Build request payload
-                args = []
-                for value_name in values.keys():
-                    args.append(call.data.get(value_name))
-                
-                # Call args list is either of length 1 or 2
+
+                # Calls close in time are merged into a single request by the write queue,
+                # affected entities are then read back right away
                 try:
-                    if len(args) == 1: response['result'] = await api_call(args[0])
-                    else: response['result'] = await api_call(args[0], args[1])
+                    response['result'] = await IC.writer.async_set({setting: value}, refresh)
                 except TimeoutError:
-                    _LOGGER.error(__name__ + ' | Timeout Error: API call (' + str(api_call.__name__) + ') timed out.' 
+                    _LOGGER.error(str(IC.friendly_name) + ' | Timeout Error: API call (' + str(service_name) + ') timed out.' 
                                   + ' Make sure this service is available for this inverter model.')
                 except Exception as e:
-                    _LOGGER.error(__name__ + ' | API call Error: ' + str(e))
-                
+                    _LOGGER.error(str(IC.friendly_name) + ' | API call Error: ' + str(e))
+
                 # Log service call for bug tracking
-                _LOGGER.info(f"{entry_title}_{service_name}({args}): {response}")
+                _LOGGER.info(f"{IC.friendly_name}_{service_name}({args}): {response}")
                 return response
-            
-            # Register service in hass
-            hass.services.async_register(DOMAIN, f"{str(entry.title).replace(' ', '_')}_{service_name}", 
-                                         service_handler,
-                                         schema=schema,
-                                         supports_response=SupportsResponse.OPTIONAL)
-
-        # Smartload requires special handling
-        @callback
-        async def smartload_handler(call: ServiceCall, 
-                                    entry_title=entry.title, 
-                                    IC_uuid = entry.entry_id) -> ServiceResponse:
-            """Return smartload json."""
-
-            # Recover Inverter from UUID then get api call
-            IC = InverterCoordinator.get_from_id(IC_uuid)
-            response = IC.api._storage.get("smartload", {"result": 'failed'})
-            return response
+
+            hubs = await async_get_targets(hass, call)
+            results = await asyncio.gather(*(set_one(IC) for IC in hubs))
+            return {IC.friendly_name: result for IC, result in zip(hubs, results)}
         
-        hass.services.async_register(DOMAIN, f"{str(entry.title).replace(' ', '_')}_smartload", 
-                                         smartload_handler,
-                                         supports_response=SupportsResponse.OPTIONAL)
+        # Register service in hass
+        hass.services.async_register(DOMAIN, f"set_{service_name}", 
+                                     service_handler,
+                                     schema=schema,
+                                     supports_response=SupportsResponse.OPTIONAL)
+
+    # Smartload requires special handling
+    @callback
+    async def smartload_handler(call: ServiceCall) -> ServiceResponse:
+        """Return smartload json, or a short answer if unchanged since the given version."""
+
+        def get_one(IC: InverterCoordinator) -> dict:
+            if not IC.supports('smartload'):
+                return {"result": 'unsupported'}
+
+            smartload = IC.smartload
+            if smartload["version"] == 0:
+                return {"result": 'failed'}
+
+            if call.data.get("since_version") == smartload["version"]:
+                return {"result": 'unchanged', "version": smartload["version"]}
+
+            return {**smartload["data"],
+                    "version": smartload["version"],
+                    "hash": smartload["hash"],
+                    "last_changed": smartload["last_changed"]}
+
+        return {IC.friendly_name: get_one(IC) for IC in await async_get_targets(hass, call)}
+    
+    hass.services.async_register(DOMAIN, "get_smartload", 
+                                 smartload_handler,
+                                 schema=vol.Schema({**TARGET_SCHEMA, vol.Optional("since_version"): int}),
+                                 supports_response=SupportsResponse.ONLY)
+
+    # Burst polling of a few keys for a limited time
+    @callback
+    async def burst_handler(call: ServiceCall) -> ServiceResponse:
+        """Start (or stop with a zero duration) burst polling on every targeted inverter."""
+        response = {}
+        for IC in await async_get_targets(hass, call):
+            keys = [key for key in call.data["keys"] if IC.supports(KEY_REQUIRES[key])]
+            if not keys:
+                response[IC.friendly_name] = {"result": 'unsupported'}
+                continue
+            IC.async_start_burst(keys, call.data["interval"], call.data["duration"])
+            response[IC.friendly_name] = {"result": 'success', "burst": IC.burst}
+        return response
+
+    hass.services.async_register(DOMAIN, "burst",
+                                 burst_handler,
+                                 schema=vol.Schema({
+                                     **TARGET_SCHEMA,
+                                     vol.Optional("keys", default=BURST_KEYS): vol.All(cv.ensure_list, [vol.In(list(GET_REQUESTS))]),
+                                     vol.Optional("interval", default=BURST_INTERVAL): vol.All(vol.Coerce(float), vol.Range(min=BURST_MIN_INTERVAL)),
+                                     vol.Optional("duration", default=BURST_DURATION): vol.All(vol.Coerce(float), vol.Range(min=0, max=BURST_MAX_DURATION)),
+                                 }),
+                                 supports_response=SupportsResponse.OPTIONAL)
+
+    # Capabilities can be probed again, e.g. after a firmware update
+    @callback
+    async def probe_handler(call: ServiceCall) -> None:
+        """Forget the capability profile of every targeted inverter, then reload it to probe again."""
+        hubs = await async_get_targets(hass, call)
+        cache = CapabilityCache.get(hass)
+        await cache.async_load()
+        for IC in hubs: cache.reset(IC.id)
+        await asyncio.gather(*(hass.config_entries.async_reload(IC.id) for IC in hubs))
+
+    hass.services.async_register(DOMAIN, "probe_capabilities",
+                                 probe_handler,
+                                 schema=vol.Schema(TARGET_SCHEMA))
 
     # Return boolean to indicate that initialization was successfully
     return True
 
 
+async def async_get_targets(hass: HomeAssistant, call: ServiceCall) -> list:
+    """Return the HUB of every inverter targeted by a service call."""
+    entry_ids = await async_extract_config_entry_ids(hass, call)
+    entry_ids.update(call.data.get("entry_id", []))
+
+    hubs = [hass.data[DOMAIN][entry_id] for entry_id in entry_ids
+            if entry_id in hass.data.get(DOMAIN, {})]
+    if not hubs:
+        raise ServiceValidationError(f"No Imeon inverter targeted by {call.service}")
+    return hubs
+
+
 async def async_setup_entry(hass: HomeAssistant, entry: config_entries.ConfigEntry):
     """
     Handle the creation of a new config entry for the integration (asynchronous).
 
     This function creates the HUB corresponding to the data in the entry.
     It then updates the config entry accordingly. It forces a first
-    update to avoid having empty data before the first refresh.
+    update to avoid having empty data before the first refresh, and
+    loads the last known data snapshot until then. The capability
+    profile of the inverter decides which entities are created, it is
+    probed in the background when unknown.
     After filtering the user's input through Unicodedata and RegEx
     the function will create a dashboard for this specific entry.
+
+    Fleet aggregate entries get a virtual HUB following their members.
     """
 
+    if entry.data.get("type") == FLEET_TYPE:
+        return await async_setup_fleet_entry(hass, entry)
+
     # Create the corresponding HUB
     data = {
         "address"  : entry.data.get("address", ""),
@@ -155,15 +257,68 @@ async def async_setup_entry(hass: HomeAssistant, entry: config_entries.ConfigEnt
     
     hass.data.setdefault(DOMAIN, {})[entry.entry_id] = IC
 
+    # Show last known values (flagged as stale) until the inverter answers
+    for unsub in await IC.async_setup_snapshot():
+        entry.async_on_unload(unsub)
+
+    # Leave out what this model lacks (probed once per serial number, without delaying setup)
+    await IC.async_setup_capabilities()
+
+    # Count this inverter in the fleet aggregates it belongs to
+    for fleet in FleetAggregate.get_all(hass).values():
+        if fleet.includes(entry.entry_id): fleet.attach(IC)
+
     # Call for HUB creation then each entity as a List
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
     return True
 
+async def async_setup_fleet_entry(hass: HomeAssistant, entry: config_entries.ConfigEntry) -> bool:
+    """Create a fleet aggregate following the inverters already set up, and those to come."""
+    fleet = FleetAggregate(hass, entry.entry_id, entry.title, entry.data.get("members", []))
+    FleetAggregate.get_all(hass)[entry.entry_id] = fleet
+
+    for uuid, IC in hass.data.get(DOMAIN, {}).items():
+        if fleet.includes(uuid): fleet.attach(IC)
+
+    @callback
+    def remove_fleet() -> None:
+        fleet.async_close()
+        FleetAggregate.get_all(hass).pop(entry.entry_id, None)
+    entry.async_on_unload(remove_fleet)
+
+    await hass.config_entries.async_forward_entry_setups(entry, FLEET_PLATFORMS)
+    return True
+
 async def async_unload_entry(hass: HomeAssistant, entry: config_entries.ConfigEntry) -> bool:
-    """Handle entry unloading."""
-    return await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
+    """
+    Handle entry unloading.
+
+    Once its entities are gone, the HUB of an inverter is taken out of
+    the fleet aggregates and closed : polling, bursts, pending writes,
+    background tasks and its HTTP session all stop, and nothing keeps a
+    reference to it anymore.
+    """
+    if entry.data.get("type") == FLEET_TYPE:
+        return await hass.config_entries.async_unload_platforms(entry, FLEET_PLATFORMS)
+
+    if not await hass.config_entries.async_unload_platforms(entry, PLATFORMS):
+        return False
+
+    for fleet in FleetAggregate.get_all(hass).values():
+        fleet.detach(entry.entry_id)
+
+    IC: InverterCoordinator = hass.data[DOMAIN].pop(entry.entry_id)
+    await IC.async_close()
+    return True
+
+async def async_remove_entry(hass: HomeAssistant, entry: config_entries.ConfigEntry) -> None:
+    """Drop what was kept on disk for a removed inverter."""
+    if entry.data.get("type") == FLEET_TYPE: return None
 
-async def update_listener(hass: HomeAssistant, entry: config_entries.ConfigFlow) -> None:
-    """Handle options update."""
-    await hass.config_entries.async_reload(entry.entry_id)
+    SessionPool.get(hass).forget(entry.entry_id)
+    cache = CapabilityCache.get(hass)
+    await cache.async_load()
+    cache.forget(entry.entry_id) # Profiles stay, by serial number
+    await Store(hass, SNAPSHOT_STORE_VERSION, SNAPSHOT_STORE_KEY + entry.entry_id).async_remove()
+    await Store(hass, HISTORY_STORE_VERSION, HISTORY_STORE_KEY + entry.entry_id).async_remove()
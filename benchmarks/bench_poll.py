@@ -0,0 +1,254 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+---
+Reproducible poll benchmark against local mock inverters.
+
+Drives InverterCoordinator._async_update_data and the sensor/text
+entities for fleets of simulated inverters, then reports poll latency
+percentiles, event loop time per cycle, state writes per minute and
+memory per HUB. Mock inverters run in their own thread so their work
+isn't counted as integration time. Time is simulated : each cycle moves
+every HUB forward by one polling interval, so refresh tiers behave as
+they would in production without waiting for them.
+
+State writes are counted at the entity level (async_write_ha_state is
+replaced by a counter), Home Assistant's state machine isn't involved.
+
+    python benchmarks/bench_poll.py --hubs 1 10 100 --cycles 20 --latency 0.02
+
+With --capture, polls are also recorded as the integration does on site
+(see capture.py) so benchmarks/replay.py can be tried without hardware.
+'''
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+from mock_inverter import MockInverter, start
+
+ROOT = Path(__file__).resolve().parents[1]
+PACKAGE = "imeon_inverter"
+
+def load_integration():
+    """Import the integration as a package, as Home Assistant would."""
+    spec = importlib.util.spec_from_file_location(PACKAGE, ROOT / "__init__.py",
+                                                  submodule_search_locations=[str(ROOT)])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE] = module
+    spec.loader.exec_module(module)
+    for name in ("inverter", "path", "sensor", "text"):
+        importlib.import_module(PACKAGE + "." + name)
+    return module
+
+
+class MockFleet():
+    """Mock inverters served from a background thread."""
+
+    def __init__(self, count: int, **options) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.inverters = [MockInverter(serial=f"9112BENCH{i:04d}", seed=i, **options) for i in range(count)]
+        started = [self.run(start(inverter)) for inverter in self.inverters]
+        self.runners = [runner for runner, _ in started]
+        self.addresses = [address for _, address in started]
+        return None
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    @property
+    def errors(self) -> int:
+        return sum(inverter.errors for inverter in self.inverters)
+
+    def close(self) -> None:
+        for runner in self.runners:
+            self.run(runner.cleanup())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def entity_classes(writes: list) -> tuple:
+    """Return sensor and text entity classes counting their state writes in writes[0]."""
+    sensor = sys.modules[PACKAGE + ".sensor"]
+    text = sys.modules[PACKAGE + ".text"]
+
+    def count_write(self) -> None:
+        writes[0] += 1
+
+    class BenchSensor(sensor.InverterSensor):
+        async_write_ha_state = count_write
+
+    class BenchText(text.InverterText):
+        async_write_ha_state = count_write
+
+    return BenchSensor, BenchText
+
+
+def create_entities(IC, entry, classes: tuple) -> list:
+    """Create the sensor and text entities of a HUB and subscribe them to their keys."""
+    path = sys.modules[PACKAGE + ".path"]
+    BenchSensor, BenchText = classes
+
+    entities = [BenchSensor(IC, key, entry, path.GET_REQUESTS[key]["friendly_name"],
+                            path.GET_REQUESTS[key]["unit"]) for key in path.LIST_FLOAT]
+    entities += [BenchSensor(IC, key, entry, val["friendly_name"], val["unit"])
+                 for key, val in path.DERIVED_SENSORS.items()]
+    entities += [BenchText(IC, key, entry, path.GET_REQUESTS[key]["friendly_name"])
+                 for key in path.LIST_TEXT]
+    entities.append(BenchText(IC, "timeline", entry, "Timeline"))
+    for entity in entities:
+        IC.async_add_key_listener(entity.data_key, entity._handle_coordinator_update)
+    return entities
+
+
+def percentile(values: list, share: float) -> float:
+    """Return the given percentile (0..1) of a list of values."""
+    if not values: return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+async def bench(hubs: int, cycles: int, args: argparse.Namespace) -> dict:
+    """Run one benchmark for a fleet of the given size."""
+    from homeassistant.core import HomeAssistant # type: ignore
+    from homeassistant.helpers import frame      # type: ignore
+    from imeon_inverter_api.client import Client # type: ignore
+
+    inverter = sys.modules[PACKAGE + ".inverter"]
+    path = sys.modules[PACKAGE + ".path"]
+    Client.BOTTLENECK_RATE = args.rate
+    fleet = MockFleet(hubs, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    config_dir = args.capture or tempfile.mkdtemp(prefix="imeon_bench_")
+    hass = HomeAssistant(config_dir)
+    if hasattr(frame, "async_setup"): frame.async_setup(hass)
+    hass.data[inverter.CAPTURE_KEY] = bool(args.capture) # Record polls for benchmarks/replay.py
+
+    # Count state writes instead of writing to the state machine
+    writes = [0]
+    classes = entity_classes(writes)
+
+    tracemalloc.start()
+    memory_before = tracemalloc.take_snapshot()
+
+    # Build HUBs and their entities
+    scheduler = inverter.FleetScheduler.get(hass, max_in_flight=args.max_in_flight, jitter=0)
+    scheduler.phase = lambda uuid, interval: 0. # No staggered start in benchmarks
+    coordinators = []
+    entities = []
+    for i, address in enumerate(fleet.addresses):
+        entry = SimpleNamespace(entry_id=f"bench{i}", title=f"Bench {i}")
+        IC = inverter.InverterCoordinator(hass, {"address": address, "username": "bench", "password": "bench"},
+                                          entry.entry_id, entry.title)
+        IC.first_call = False
+        coordinators.append(IC)
+
+        entities += create_entities(IC, entry, classes)
+
+    # The wall clock seen by HUBs moves forward by one interval per cycle
+    # NOTE a fresh clock for every fleet size, put back once done
+    interval = min(path.REFRESH_TIERS.values())
+    offset = [0.]
+    clock = inverter.time
+    inverter.time = SimpleNamespace(time=lambda: time.time() + offset[0],
+                                    monotonic=lambda: time.monotonic() + offset[0], perf_counter=time.perf_counter)
+    try:
+        # Warm up : first full fetch of every category
+        await asyncio.gather(*(IC.init_and_store() for IC in coordinators))
+
+        memory_after = tracemalloc.take_snapshot()
+        ignored = [tracemalloc.Filter(False, "*mock_inverter.py"), tracemalloc.Filter(False, "*aiohttp/web*")]
+        memory = sum(stat.size_diff for stat in memory_after.filter_traces(ignored).compare_to(
+                     memory_before.filter_traces(ignored), "filename"))
+        tracemalloc.stop()
+
+        # Polling cycles
+        latencies = []
+        loop_times = []
+        writes[0] = 0
+
+        async def poll(IC) -> None:
+            started = time.perf_counter()
+            await IC._async_update_data()
+            latencies.append(time.perf_counter() - started)
+
+        for _ in range(cycles):
+            offset[0] += interval # Simulated time, refresh tiers and heartbeats included
+
+            cpu = time.thread_time()
+            await asyncio.gather(*(poll(IC) for IC in coordinators))
+            for IC in coordinators:
+                IC.async_update_listeners()
+            loop_times.append(time.thread_time() - cpu)
+
+        for IC in coordinators:
+            if IC.capture is not None: await IC.capture.async_close()
+    finally:
+        inverter.time = clock
+        await close_sessions(coordinators)
+        errors = fleet.errors
+        fleet.close()
+
+    return {
+        "hubs": hubs,
+        "entities": len(entities),
+        "cycles": cycles,
+        "poll_p50_ms": round(percentile(latencies, .5) * 1000, 2),
+        "poll_p90_ms": round(percentile(latencies, .9) * 1000, 2),
+        "poll_p99_ms": round(percentile(latencies, .99) * 1000, 2),
+        "loop_ms_per_cycle": round(statistics.mean(loop_times) * 1000, 2),
+        "writes_per_minute": round(writes[0] / cycles * 60 / interval, 1),
+        "kib_per_hub": round(memory / hubs / 1024, 1),
+        "server_errors": errors,
+        "rejected_values": sum(IC.stats.value("rejected_values") for IC in coordinators),
+    }
+
+
+async def close_sessions(coordinators: list) -> None:
+    """Close every HTTP session and the shared pool."""
+    for IC in coordinators:
+        await IC.api._client.close_session()
+    await coordinators[0].pool.async_close()
+
+
+def report(results: list) -> None:
+    """Print results as a table."""
+    columns = list(results[0])
+    print(" | ".join(f"{c:>17}" for c in columns))
+    for result in results:
+        print(" | ".join(f"{result[c]:>17}" for c in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hubs", type=int, nargs="+", default=[1, 10, 100], help="fleet sizes to benchmark")
+    parser.add_argument("--cycles", type=int, default=20, help="polling cycles per fleet size")
+    parser.add_argument("--latency", type=float, default=0., help="mock inverter latency (seconds)")
+    parser.add_argument("--jitter", type=float, default=0., help="mock inverter jitter (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0., help="mock inverter share of failed requests")
+    parser.add_argument("--rate", type=float, default=0., help="API rate limit between requests (1.2s on real setups)")
+    parser.add_argument("--max-in-flight", type=int, default=2, help="polls running at the same time")
+    parser.add_argument("--capture", help="record polls into <capture>/imeon_inverter_captures, for replay.py")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    load_integration()
+    results = [asyncio.run(bench(hubs, args.cycles, args)) for hubs in args.hubs]
+    report(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
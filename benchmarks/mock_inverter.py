@@ -0,0 +1,223 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+---
+Local stand-in for an Imeon inverter web server.
+
+Serves every endpoint used by imeon_inverter_api, with values generated
+from path.py so each entity gets data. Latency, jitter and error rate
+are configurable so polls can be benchmarked without real hardware.
+
+    python benchmarks/mock_inverter.py --port 8080 --latency 0.05 --error-rate 0.01
+'''
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+ROOT = Path(__file__).resolve().parents[1]
+
+def load_path_module():
+    """Load path.py from the integration without importing Home Assistant."""
+    spec = importlib.util.spec_from_file_location("imeon_path", ROOT / "path.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+path = load_path_module()
+
+# Fake values
+TEXT_VALUES = {
+    "inverter": "IMEON 9.12",
+    "software": "1.8.1.0",
+    "status": "charging",
+    "inverter_mode": "SMG",
+    "inverter_state": "on",
+    "active": "true",
+}
+NUMBER_RANGES = {
+    "pv_power": (0., 6000.),
+    "power": (-3000., 6000.),
+    "voltage": (220., 240.),
+    "current": (0., 30.),
+    "frequency": (49.9, 50.1),
+    "soc": (0., 100.),
+    "temperature": (20., 60.),
+}
+
+def split_keys() -> dict:
+    """Return {category: [fields]} for every GET_REQUESTS key."""
+    fields = {category: [] for category in path.GET_CATEGORIES}
+    for key, category in path.KEY_CATEGORIES.items():
+        fields[category].append(key[len(category) + 1:])
+    return fields
+
+class MockInverter():
+    """Fake inverter answering like the real web interface."""
+
+    def __init__(self, serial: str = "9112BENCH0000", latency: float = 0.,
+                 jitter: float = 0., error_rate: float = 0., seed: int | None = None,
+                 phases: int = 3, meter: bool = True, password: str | None = None) -> None:
+        self.serial = serial
+        self.phases = phases
+        self.meter = meter       # No electric meter endpoint if False
+        self.password = password # Any password is accepted if None
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.fields = split_keys()
+        self.values = {}
+        self.requests = 0
+        self.errors = 0
+        self.settings = {}
+        self.timeline = []
+        return None
+
+    # VALUES #
+    def value(self, category: str, field: str):
+        """Return the next value of a field, as a random walk for numbers."""
+        key = category + "_" + field
+        info = path.GET_REQUESTS.get(key, {"type": "number"})
+        if info["type"] == "text":
+            return TEXT_VALUES.get(field, field)
+
+        low, high = next((r for k, r in NUMBER_RANGES.items() if k in key), (0., 1000.))
+        previous = self.values.get(key, self.random.uniform(low, high))
+        value = min(high, max(low, previous + self.random.gauss(0, (high - low) / 100)))
+        self.values[key] = value
+        return round(value, 3)
+
+    def category(self, category: str) -> dict:
+        """Return a payload, single-phase models leave out the fields of phases 2 and 3."""
+        return {field: self.value(category, field) for field in self.fields[category]
+                if self.phases == 3 or not field.endswith(("_l2", "_l3"))}
+
+    def add_event(self) -> None:
+        """Add a new timeline event, newest first."""
+        kind = self.random.choice(list(path.TIMELINE_WARNINGS))
+        self.timeline.insert(0, {"time": time.strftime("%Y/%m/%d %H:%M:%S"),
+                                 "type": kind, "message": f"Event {kind}"})
+        del self.timeline[50:]
+
+    # WEB SERVER #
+    @web.middleware
+    async def middleware(self, request: web.Request, handler):
+        """Add latency, jitter and random errors to every request."""
+        self.requests += 1
+        await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            raise web.HTTPInternalServerError()
+        return await handler(request)
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        app.add_routes([
+            web.get("/", self.index),
+            web.post("/login", self.login),
+            web.get("/data", self.data),
+            web.get("/imeon-status", self.status),
+            web.get("/scan", self.scan),
+            web.get("/api/battery", self.timed("battery")),
+            web.get("/api/grid", self.timed("grid")),
+            web.get("/api/pv", self.timed("pv")),
+            web.get("/api/input", self.timed("input")),
+            web.get("/api/output", self.timed("output")),
+            *([web.get("/api/em", self.timed("meter"))] if self.meter else []),
+            web.get("/api/temp", self.timed("temp")),
+            web.get("/api/monitor", self.monitor),
+            web.get("/api/manager", self.timed("manager")),
+            web.get("/api/smartload", self.smartload),
+            web.post("/api/set", self.set),
+        ])
+        return app
+
+    async def index(self, request: web.Request) -> web.Response:
+        return web.Response(text="<html><head><title>IMEON</title></head><body>Imeon Energy</body></html>",
+                            content_type="text/html")
+
+    async def login(self, request: web.Request) -> web.Response:
+        if self.password is not None and (await request.post()).get("passwd") != self.password:
+            return web.json_response({"accessGranted": False})
+        response = web.json_response({"accessGranted": True})
+        response.set_cookie("session", self.serial)
+        return response
+
+    async def data(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "type": TEXT_VALUES["inverter"],
+            "software": TEXT_VALUES["software"],
+            "serial": self.serial,
+            "max_ac_charging_current": 20,
+            "injection_power": self.settings.get("injection_power", 3000),
+            "enable_status": {"discharge_night": "1", "charge_bat_with_grid": "0"},
+        })
+
+    async def status(self, request: web.Request) -> web.Response:
+        if self.random.random() < 0.1: self.add_event()
+        return web.json_response({"state_timeline": {"detail": self.timeline or [{}]}})
+
+    async def scan(self, request: web.Request) -> web.Response:
+        return web.json_response({})
+
+    def timed(self, category: str):
+        async def handler(request: web.Request) -> web.Response:
+            return web.json_response({"result": json.dumps(self.category(category))})
+        return handler
+
+    async def monitor(self, request: web.Request) -> web.Response:
+        if request.query.get("time") == "day": # History, one value per quarter of an hour
+            history = {field: [round(self.random.uniform(0, 500), 1) for _ in range(96)]
+                       for field in self.fields["monitoring"]}
+            return web.json_response({"result": json.dumps(history)})
+        category = "monitoring_minute" if request.query.get("time") == "minute" else "monitoring"
+        return web.json_response({"result": json.dumps(self.category(category))})
+
+    async def smartload(self, request: web.Request) -> web.Response:
+        return web.json_response({"result": json.dumps({"loads": []})})
+
+    async def set(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        self.settings.update({k: v for k, v in data.items() if k != "permasave"})
+        return web.Response(text="true")
+
+
+async def start(inverter: MockInverter, host: str = "127.0.0.1", port: int = 0) -> tuple:
+    """Start a mock inverter, return its runner and bound address ("host:port")."""
+    runner = web.AppRunner(inverter.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0., help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0., help="random seconds added on top of latency")
+    parser.add_argument("--error-rate", type=float, default=0., help="share of requests answering HTTP 500")
+    parser.add_argument("--phases", type=int, choices=[1, 3], default=3, help="single or three-phase model")
+    parser.add_argument("--no-meter", action="store_true", help="model without an electric meter endpoint")
+    parser.add_argument("--password", default=None, help="only accept this password (any by default)")
+    args = parser.parse_args()
+
+    inverter = MockInverter(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, phases=args.phases,
+                            meter=not args.no_meter, password=args.password)
+    web.run_app(inverter.app(), host=args.host, port=args.port)
+    sys.exit(0)
@@ -0,0 +1,128 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+---
+Offline replay of captured inverter polls.
+
+Feeds the polls recorded on site (`record: true` in the YAML
+configuration, see capture.py) back through
+InverterCoordinator.fetch_and_store and the sensor/text entities, each
+capture folder driving its own HUB. Requests are replaced by the
+captured payloads and time by the capture's own clock, so validation and
+derived values behave as they did on site, without the hardware.
+
+Reports, for each capture, the poll and fetch times measured on site
+and the integration's own cost of processing them (store, validation,
+derived values and entity updates), state writes per minute and
+rejected readings. `--speed` replays at a multiple of real time (gaps
+between polls and fetch times are both scaled), 0 as fast as possible.
+
+    python benchmarks/replay.py /config/imeon_inverter_captures/<entry_id> --speed 0
+'''
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib
+import json
+import statistics
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+from types import SimpleNamespace
+
+from bench_poll import PACKAGE, close_sessions, create_entities, entity_classes, load_integration, percentile, report
+
+
+async def fetch(IC, record: dict, speed: float, category: str) -> None:
+    """Stand-in for InverterCoordinator.fetch_category, serving a captured payload."""
+    captured = record["categories"][category]
+    if speed: await asyncio.sleep(captured["fetch"] / speed)
+    IC.api._storage[category] = captured["payload"]
+
+
+async def replay(folders: list, speed: float) -> list:
+    """Replay every capture folder through its own HUB, return one result per folder."""
+    from homeassistant.core import HomeAssistant # type: ignore
+    from homeassistant.helpers import frame      # type: ignore
+
+    inverter = sys.modules[PACKAGE + ".inverter"]
+    capture = importlib.import_module(PACKAGE + ".capture")
+
+    hass = HomeAssistant(tempfile.mkdtemp(prefix="imeon_replay_"))
+    if hasattr(frame, "async_setup"): frame.async_setup(hass)
+
+    # The capture's clock drives validation, derived values and the age of entity writes (heartbeats)
+    clock = [0.]
+    inverter.time = SimpleNamespace(time=lambda: clock[0], monotonic=lambda: clock[0], perf_counter=time.perf_counter)
+
+    writes = [[0] for _ in folders]
+    coordinators, records = [], []
+    for i, folder in enumerate(folders):
+        entry = SimpleNamespace(entry_id=f"replay{i}", title=Path(folder).name)
+        IC = inverter.InverterCoordinator(hass, {"address": "replay", "username": "", "password": ""},
+                                          entry.entry_id, entry.title)
+        create_entities(IC, entry, entity_classes(writes[i]))
+        coordinators.append(IC)
+        records += [(record["time"], i, record) for record in capture.read_segments(folder)]
+    records.sort(key=lambda item: item[:2])
+    if not records:
+        await close_sessions(coordinators)
+        raise SystemExit("No captured poll found in " + ", ".join(map(str, folders)))
+
+    costs = [[] for _ in folders]
+    start, wall = records[0][0], time.perf_counter()
+    for stamp, i, record in records:
+        if speed: # Keep the pace of the capture
+            await asyncio.sleep(max(0., (stamp - start) / speed - (time.perf_counter() - wall)))
+        clock[0] = stamp
+
+        IC = coordinators[i]
+        IC.fetch_category = partial(fetch, IC, record, speed)
+        cpu = time.thread_time()
+        await IC.fetch_and_store(list(record["categories"]))
+        IC.async_update_listeners()
+        costs[i].append(time.thread_time() - cpu)
+
+    results = []
+    for i, IC in enumerate(coordinators):
+        polls = [record for _, j, record in records if j == i]
+        fetches = [captured["fetch"] for record in polls for captured in record["categories"].values()]
+        durations = [record["duration"] for record in polls]
+        span = max(polls[-1]["time"] - polls[0]["time"], 1.) if polls else 1.
+        results.append({
+            "capture": IC.friendly_name[:17],
+            "polls": len(polls),
+            "errors": sum(record["error"] is not None for record in polls),
+            "minutes": round(span / 60, 1),
+            "site_poll_p50_ms": round(percentile(durations, .5) * 1000, 2),
+            "site_poll_p90_ms": round(percentile(durations, .9) * 1000, 2),
+            "site_fetch_p90_ms": round(percentile(fetches, .9) * 1000, 2),
+            "cpu_ms_per_poll": round(statistics.mean(costs[i]) * 1000, 3) if costs[i] else 0.,
+            "cpu_p90_ms": round(percentile(costs[i], .9) * 1000, 3),
+            "writes_per_minute": round(writes[i][0] / span * 60, 1), # Capture time, whatever the speed
+            "rejected_values": IC.stats.value("rejected_values"),
+        })
+
+    await close_sessions(coordinators)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", help="capture folders, one per inverter")
+    parser.add_argument("--speed", type=float, default=0., help="multiple of real time, 0 for as fast as possible")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    load_integration()
+    results = asyncio.run(replay(args.captures, args.speed))
+    report(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
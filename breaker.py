@@ -0,0 +1,99 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+'''
+
+from __future__ import annotations
+
+import asyncio
+import async_timeout
+import logging
+import random
+import time
+from typing import Any, Dict
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+CLOSED = "closed"       # Polling normally
+OPEN = "open"           # Unreachable, waiting for the backoff to elapse
+HALF_OPEN = "half_open" # Trying a single poll to see if the inverter is back
+
+async def async_reachable(address: str, timeout: float = BREAKER_PROBE_TIMEOUT) -> bool:
+    """Return whether something accepts TCP connections at an address ("host" or "host:port")."""
+    host, _, port = address.partition(":")
+    try:
+        async with async_timeout.timeout(timeout):
+            _, writer = await asyncio.open_connection(host, int(port or 80))
+    except (OSError, TimeoutError, ValueError):
+        return False
+    writer.close()
+    return True
+
+
+# CIRCUIT BREAKER #
+class CircuitBreaker():
+    """
+    Stop polling an inverter that keeps failing, and back off until it returns.
+
+    After BREAKER_THRESHOLD polls in a row fail the breaker opens : polls
+    are skipped until the backoff (doubled after each failed attempt, with
+    random jitter, up to BREAKER_MAX_BACKOFF) has elapsed. The breaker is
+    then half-open : a single attempt decides whether it closes again or
+    reopens for longer.
+    """
+
+    def __init__(self, name: str, base: float, threshold: int = BREAKER_THRESHOLD,
+                 max_backoff: float = BREAKER_MAX_BACKOFF, jitter: float = BREAKER_JITTER) -> None:
+        self.name = name
+        self.base = base
+        self.threshold = threshold
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.state = CLOSED
+        self.failures = 0          # in a row
+        self.trips = 0             # times the breaker opened
+        self._backoff = base       # seconds before the next attempt once open
+        self._retry_at = 0.        # monotonic time of the next attempt
+        return None
+
+    def allow(self) -> bool:
+        """Return whether a poll may be attempted now, going half-open once the backoff elapsed."""
+        if self.state != OPEN: return True
+        if time.monotonic() < self._retry_at: return False
+        self.state = HALF_OPEN
+        return True
+
+    def retry_in(self) -> float:
+        """Return the seconds left before the next attempt."""
+        return max(0., self._retry_at - time.monotonic())
+
+    def succeeded(self) -> None:
+        if self.state != CLOSED:
+            _LOGGER.info(f"{self.name} | Reachable again after {self.failures} failed attempt(s)")
+        self.state = CLOSED
+        self.failures = 0
+        self._backoff = self.base
+
+    def failed(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            if self.state == CLOSED: self.trips += 1
+            delay = self._backoff * random.uniform(1 - self.jitter, 1 + self.jitter)
+            self._retry_at = time.monotonic() + delay
+            self._backoff = min(self._backoff * 2, self.max_backoff)
+            self.state = OPEN
+            _LOGGER.warning(f"{self.name} | Unreachable, next attempt in {round(delay)}s")
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the breaker state as a JSON serializable object."""
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "trips": self.trips,
+            "retry_in": round(self.retry_in(), 1) if self.state == OPEN else None,
+        }
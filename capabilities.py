@@ -0,0 +1,123 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+'''
+
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict
+
+import aiohttp
+
+from homeassistant.core import HomeAssistant, callback # type: ignore
+from homeassistant.helpers.storage import Store        # type: ignore
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+# Categories fetched to tell what a model supports
+PROBE_CATEGORIES = ["grid", "output", "meter", "manager", "smartload"]
+
+# Fields only reported by three-phase models, by category
+PHASE_FIELDS = {"grid": ["voltage_l2", "voltage_l3"], "output": ["voltage_l2", "voltage_l3"]}
+
+def endpoint_missing(error: BaseException) -> bool:
+    """Return whether a request failed because the inverter has no such endpoint (HTTP 404)."""
+    while error is not None:
+        if isinstance(error, aiohttp.ClientResponseError) and error.status == 404: return True
+        error = error.__cause__
+    return False
+
+def build_profile(serial: str, payloads: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the capability profile of an inverter from the raw payload of every probed category.
+
+    Capabilities are told by the endpoints and fields the inverter reports,
+    not by their current values (a three-phase inverter may well read 0 V
+    on a phase). A payload of None means the endpoint doesn't exist.
+    """
+    def reports(category: str, field: str) -> bool:
+        payload = payloads.get(category)
+        return isinstance(payload, dict) and payload.get(field) is not None
+
+    capabilities = []
+    if any(reports(category, field) for category, fields in PHASE_FIELDS.items() for field in fields):
+        capabilities.append("three_phase")
+    if reports("meter", "power"): capabilities.append("meter")
+    if reports("manager", "relay_state"): capabilities.append("relay")
+    if payloads.get("smartload") is not None: capabilities.append("smartload")
+
+    return {
+        "serial": serial,
+        "phases": 3 if "three_phase" in capabilities else 1,
+        "capabilities": capabilities,
+    }
+
+
+# CAPABILITY CACHE #
+class CapabilityCache():
+    """
+    Capability profiles of every inverter, by serial number.
+
+    Profiles are probed once per serial number then kept on disk, so
+    entities and services a model lacks are left out from the next
+    startup on without probing again. Each config entry remembers the
+    serial number of its inverter. A profile is only saved once every
+    probed endpoint gave a definite answer, and can be reset to probe
+    again (e.g. after a firmware update).
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self.hass = hass
+        self._store = Store(hass, CAPABILITIES_STORE_VERSION, CAPABILITIES_STORE_KEY)
+        self._saved: Dict[str, Dict] | None = None # {"profiles": {serial: profile}, "entries": {entry_id: serial}}
+        return None
+
+    @staticmethod
+    @callback
+    def get(hass: HomeAssistant) -> CapabilityCache:
+        """Return the cache of this Home Assistant instance, create it if needed."""
+        if CAPABILITIES_KEY not in hass.data:
+            hass.data[CAPABILITIES_KEY] = CapabilityCache(hass)
+        return hass.data[CAPABILITIES_KEY]
+
+    async def async_load(self) -> None:
+        if self._saved is None:
+            self._saved = await self._store.async_load() or {"profiles": {}, "entries": {}}
+
+    async def async_get_entry(self, uuid: str) -> Dict[str, Any] | None:
+        """Return the profile of the inverter behind a config entry, if already probed."""
+        await self.async_load()
+        serial = self._saved["entries"].get(str(uuid))
+        return self._saved["profiles"].get(serial)
+
+    async def async_get_serial(self, serial: str) -> Dict[str, Any] | None:
+        """Return the profile of a serial number, if already probed."""
+        await self.async_load()
+        return self._saved["profiles"].get(str(serial))
+
+    @callback
+    def save(self, uuid: str, profile: Dict[str, Any]) -> None:
+        """Remember the profile of an inverter and which config entry it belongs to."""
+        self._saved["profiles"][str(profile["serial"])] = profile
+        self._saved["entries"][str(uuid)] = str(profile["serial"])
+        self._store.async_delay_save(lambda: self._saved, 0)
+
+    @callback
+    def reset(self, uuid: str) -> None:
+        """Forget the profile of the inverter behind a config entry, so it is probed again."""
+        serial = self._saved["entries"].pop(str(uuid), None)
+        if serial is not None:
+            self._saved["profiles"].pop(serial, None)
+            self._store.async_delay_save(lambda: self._saved, 0)
+
+    @callback
+    def forget(self, uuid: str) -> None:
+        """Drop the link between a config entry and its inverter (profiles are kept)."""
+        if self._saved and self._saved["entries"].pop(str(uuid), None) is not None:
+            self._store.async_delay_save(lambda: self._saved, 0)
@@ -0,0 +1,112 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+'''
+
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+from homeassistant.core import HomeAssistant, Event, callback # type: ignore
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP     # type: ignore
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+def read_segments(directory: str | Path) -> Iterator[Dict[str, Any]]:
+    """Yield every poll saved in a capture directory, oldest first."""
+    for segment in sorted(Path(directory).glob("*" + SEGMENT_SUFFIX)):
+        with gzip.open(segment, "rt", encoding="utf-8") as file:
+            for line in file:
+                if line.strip(): yield json.loads(line)
+
+
+# POLL CAPTURE #
+class PollCapture():
+    """
+    Opt-in recording of the raw payloads and timings of every poll of an inverter.
+
+    Each fetch (regular poll, read-back or burst) is kept as one record :
+    its start time, total duration, the raw payload and fetch time of
+    every category and the error that interrupted it, if any. Records
+    are buffered then written CAPTURE_SEGMENT_POLLS at a time as a gzip
+    JSON lines segment, from the executor. Only the newest CAPTURE_SEGMENTS
+    segments are kept, so the ring stays bounded on disk. Captures can
+    be replayed offline with benchmarks/replay.py.
+    """
+
+    def __init__(self, hass: HomeAssistant, uuid: str, name: str,
+                 segment_polls: int = CAPTURE_SEGMENT_POLLS, segments: int = CAPTURE_SEGMENTS) -> None:
+        self.hass = hass
+        self.name = name
+        self.directory = Path(hass.config.path(CAPTURE_DIR, str(uuid)))
+        self.segment_polls = segment_polls
+        self.segments = segments
+        self.recorded = 0                   # polls recorded since startup
+        self._buffer: list = []             # records not written yet
+        self._writes: set = set()           # segment writes running in the executor
+        self._unsub_stop = hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, self._async_stop)
+        return None
+
+    @callback
+    def add(self, started: float, duration: float, categories: Dict[str, Any], error: str | None = None) -> None:
+        """Record a fetch, write a segment once enough are buffered."""
+        self._buffer.append({"time": started, "duration": round(duration, 4),
+                             "categories": categories, "error": error})
+        self.recorded += 1
+        if len(self._buffer) >= self.segment_polls: self.async_flush()
+
+    @callback
+    def async_flush(self) -> None:
+        """Write the buffered records as a new segment, in the background."""
+        if not self._buffer: return None
+        records, self._buffer = self._buffer, []
+        task = self.hass.async_add_executor_job(self._write, records)
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    def _write(self, records: list) -> None:
+        """Write a segment and drop the oldest ones beyond the ring size (executor)."""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            segment = self.directory / f"{int(records[0]['time'] * 1000):015d}{SEGMENT_SUFFIX}"
+            with gzip.open(segment, "wt", encoding="utf-8") as file:
+                for record in records:
+                    file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            for old in sorted(self.directory.glob("*" + SEGMENT_SUFFIX))[:-self.segments]:
+                old.unlink()
+        except OSError as e:
+            _LOGGER.error(str(self.name) + ' | Capture Error: ' + str(e))
+
+    async def _async_stop(self, event: Event) -> None:
+        self._unsub_stop = None
+        await self.async_close()
+
+    async def async_close(self) -> None:
+        """Write what is still buffered and wait for every segment to be on disk."""
+        if self._unsub_stop is not None:
+            self._unsub_stop()
+            self._unsub_stop = None
+        self.async_flush()
+        if self._writes: await asyncio.wait(self._writes)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the capture state as a JSON serializable object."""
+        return {
+            "directory": str(self.directory),
+            "recorded": self.recorded,
+            "buffered": len(self._buffer),
+            "segment_polls": self.segment_polls,
+            "segments": self.segments,
+        }
@@ -6,15 +6,17 @@ Rodrigue Lemaire
 July 2024
 """
 
+import ipaddress
 import logging
 from typing import Any
 import voluptuous as vol
 
 from homeassistant import config_entries
 from homeassistant.core import callback
+from homeassistant.helpers import config_validation as cv
 
-from .const import DOMAIN
-from .inverter import InverterCoordinator
+from .const import DOMAIN, FLEET_TYPE, DISCOVERY_SUBNET
+from .discovery import async_check_login, async_scan, subnet_hosts
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -23,8 +25,15 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
     VERSION = 4
 
+    def __init__(self) -> None:
+        self._discovered: list = [] # Addresses found by the last scan
+
     async def async_step_user(self, user_input: dict[str, Any] | None = None) -> config_entries.ConfigFlowResult:
-        """Handle the user step for creating a new configuration entry."""
+        """Let the user choose between finding inverters, adding one by hand or a fleet aggregate."""
+        return self.async_show_menu(step_id="user", menu_options=["discovery", "inverter", "fleet"])
+
+    async def async_step_inverter(self, user_input: dict[str, Any] | None = None) -> config_entries.ConfigFlowResult:
+        """Handle the inverter step for creating a new configuration entry."""
         schema = vol.Schema({
             vol.Required("inverter"): str,
             vol.Required("address"): str,
@@ -33,13 +42,88 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         })
 
         if user_input is None:
-            return self.async_show_form(step_id="user", data_schema=schema)
+            return self.async_show_form(step_id="inverter", data_schema=schema)
+
+        return await self.async_create_inverter(user_input, "inverter", schema)
+
+    async def async_step_discovery(self, user_input: dict[str, Any] | None = None) -> config_entries.ConfigFlowResult:
+        """Scan a subnet for Imeon inverters."""
+        errors = {}
+        if user_input is not None:
+            try:
+                subnet_hosts(user_input["subnet"])
+            except ValueError:
+                errors["subnet"] = "invalid_subnet"
+            else:
+                configured = {entry.data.get("address") for entry in self._async_current_entries()}
+                self._discovered = [address for address in await async_scan(user_input["subnet"], user_input["port"])
+                                    if address not in configured]
+                if self._discovered:
+                    return await self.async_step_discovered()
+                errors["base"] = "no_inverter_found"
+
+        schema = vol.Schema({
+            vol.Required("subnet", default=await self.async_local_subnet()): str,
+            vol.Required("port", default=80): vol.All(vol.Coerce(int), vol.Range(min=1, max=65535)),
+        })
+        return self.async_show_form(step_id="discovery", data_schema=schema, errors=errors)
+
+    async def async_step_discovered(self, user_input: dict[str, Any] | None = None) -> config_entries.ConfigFlowResult:
+        """Let the user pick one of the inverters found and enter its credentials."""
+        schema = vol.Schema({
+            vol.Required("address", default=self._discovered[0]): vol.In(self._discovered),
+            vol.Required("inverter"): str,
+            vol.Required("username"): str,
+            vol.Required("password"): str,
+        })
+
+        if user_input is None:
+            return self.async_show_form(step_id="discovered", data_schema=schema,
+                                        description_placeholders={"count": str(len(self._discovered))})
 
+        return await self.async_create_inverter(user_input, "discovered", schema)
+
+    async def async_create_inverter(self, user_input: dict[str, Any], step_id: str,
+                                    schema: vol.Schema) -> config_entries.ConfigFlowResult:
+        """Create the inverter entry once a single login succeeded, show the form again otherwise."""
         data = {
-            "address": user_input["address"],
+            "address": user_input["address"].strip(),
             "username": user_input["username"],
             "password": user_input["password"],
         }
+        self._async_abort_entries_match({"address": data["address"]})
+
+        error = await async_check_login(self.hass, **data)
+        if error is not None:
+            return self.async_show_form(step_id=step_id, errors={"base": error},
+                                        data_schema=self.add_suggested_values_to_schema(schema, user_input),
+                                        description_placeholders={"count": str(len(self._discovered))})
+
+        return self.async_create_entry(title=user_input["inverter"], data=data)
+
+    async def async_local_subnet(self) -> str:
+        """Return the /24 subnet Home Assistant is on, to be suggested for discovery."""
+        try:
+            from homeassistant.components import network # type: ignore
+            subnet = ipaddress.ip_network(await network.async_get_source_ip(self.hass) + "/24", strict=False)
+        except Exception: # Network integration not loaded
+            return DISCOVERY_SUBNET
+        return str(subnet) if subnet.version == 4 else DISCOVERY_SUBNET
+
+    async def async_step_fleet(self, user_input: dict[str, Any] | None = None) -> config_entries.ConfigFlowResult:
+        """Handle the fleet step, creating a virtual device summing up several inverters."""
+        schema = vol.Schema({
+            vol.Required("inverter", default="Imeon Fleet"): str,
+            vol.Optional("members", default=[]): cv.multi_select(inverter_entries(self.hass)),
+        })
+
+        if user_input is None:
+            return self.async_show_form(step_id="fleet", data_schema=schema)
+
+        data = {
+            "type": FLEET_TYPE,
+            "members": user_input.get("members", []), # None selected means every inverter
+        }
 
         return self.async_create_entry(title=user_input["inverter"], data=data)
 
@@ -47,9 +131,17 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     @callback
     def async_get_options_flow(config_entry: config_entries.ConfigEntry) -> config_entries.OptionsFlow:
         """Return the options flow handler."""
+        if config_entry.data.get("type") == FLEET_TYPE:
+            return FleetOptionsFlowHandler(config_entry)
         return OptionsFlowHandler(config_entry)
 
 
+def inverter_entries(hass) -> dict[str, str]:
+    """Return the title of every inverter config entry, by entry id."""
+    return {entry.entry_id: entry.title for entry in hass.config_entries.async_entries(DOMAIN)
+            if entry.data.get("type") != FLEET_TYPE}
+
+
 class OptionsFlowHandler(config_entries.OptionsFlow):
     """Handle the options flow for updating existing configurations."""
 
@@ -61,14 +153,12 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
         """Provide a form to update the configuration entry."""
         try:
             if user_input is not None:
-                HUB = InverterCoordinator.get_from_id(self._config_entry.entry_id)
-                HUB.update(user_input)
-
-                # Update config entry
+                # Update config entry, then reload it : the HUB is closed and a new one created
                 self.hass.config_entries.async_update_entry(
                     self._config_entry, data=user_input
                 )
-                return self.async_create_entry(title=self.config_entry.title, data=user_input)
+                self.hass.config_entries.async_schedule_reload(self._config_entry.entry_id)
+                return self.async_create_entry(title=self.config_entry.title, data={})
 
             # Define the schema with default values
             schema = vol.Schema({
@@ -87,3 +177,27 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
                 errors={"base": "unknown_error"}
             )
 
+
+class FleetOptionsFlowHandler(config_entries.OptionsFlow):
+    """Handle the options flow for changing the members of a fleet aggregate."""
+
+    def __init__(self, config_entry: config_entries.ConfigEntry) -> None:
+        """Initialize the options flow handler."""
+        self._config_entry = config_entry
+
+    async def async_step_init(self, user_input: dict[str, Any] | None = None) -> config_entries.ConfigFlowResult:
+        return await self.async_step_fleet(user_input)
+
+    async def async_step_fleet(self, user_input: dict[str, Any] | None = None) -> config_entries.ConfigFlowResult:
+        """Provide a form to choose the inverters of the fleet."""
+        if user_input is not None:
+            data = {**self._config_entry.data, "members": user_input.get("members", [])}
+            self.hass.config_entries.async_update_entry(self._config_entry, data=data)
+            self.hass.config_entries.async_schedule_reload(self._config_entry.entry_id)
+            return self.async_create_entry(title=self._config_entry.title, data={})
+
+        schema = vol.Schema({
+            vol.Optional("members", default=self._config_entry.data.get("members", [])):
+                cv.multi_select(inverter_entries(self.hass)),
+        })
+        return self.async_show_form(step_id="fleet", data_schema=schema)
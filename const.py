@@ -8,4 +8,85 @@ July 2024
 
 DOMAIN = "imeon_inverter"
 HUBNAME = "imeon_inverter_hub"
-TIMEOUT = 10 # seconds
\ No newline at end of file
+TIMEOUT = 10 # seconds
+
+# Shared HTTP session pool
+POOL_KEY = DOMAIN + "_session_pool"
+POOL_SIZE = 20                 # connections shared by every inverter
+POOL_KEEPALIVE = 30            # seconds
+SESSION_LIFETIME = 3600        # seconds before logging in again
+SESSION_SAVE_DELAY = 10        # seconds
+SESSION_STORE_KEY = DOMAIN + ".sessions"
+SESSION_STORE_VERSION = 1
+
+
+# Fleet scheduler
+SCHEDULER_KEY = DOMAIN + "_scheduler"
+FLEET_MAX_IN_FLIGHT = 2        # polls running at the same time
+FLEET_JITTER = 2               # seconds
+FLEET_HISTORY = 20             # cycles kept for timing stats
+
+# Last known data snapshot
+SNAPSHOT_INTERVAL = 300        # seconds between two saves
+SNAPSHOT_STORE_KEY = DOMAIN + ".snapshot."
+SNAPSHOT_STORE_VERSION = 1
+
+# Diagnostics
+STATS_WINDOW = 100             # polls kept in rolling histograms
+DIAGNOSTICS_KEY = "diagnostics"
+
+# Coalesced service writes
+WRITE_DEBOUNCE = 0.5           # seconds to wait for other changes
+WRITE_MAX_DELAY = 2            # seconds a change may be held back at most
+
+# Timeline
+TIMELINE_BUFFER_SIZE = 50      # events kept in memory
+TIMELINE_EVENT = DOMAIN + "_timeline_event"
+
+# Long-term statistics backfill
+HISTORY_TIME = "day"           # monitoring history requested from the inverter
+HISTORY_WINDOW = 86400         # seconds covered by that history
+HISTORY_STORE_KEY = DOMAIN + ".history."
+HISTORY_STORE_VERSION = 1
+
+# Capability profiles
+CAPABILITIES_KEY = DOMAIN + "_capabilities"
+CAPABILITIES_STORE_KEY = DOMAIN + ".capabilities"
+CAPABILITIES_STORE_VERSION = 1
+
+# Circuit breaker for unreachable inverters
+BREAKER_THRESHOLD = 3          # failed polls in a row before polling stops
+BREAKER_MAX_BACKOFF = 600      # seconds between two attempts at most
+BREAKER_JITTER = 0.2           # share of the backoff randomised
+BREAKER_PROBE_TIMEOUT = 2      # seconds for the TCP reachability check
+
+# Burst polling
+BURST_KEYS = ["pv_power_total", "meter_power", "battery_power"] # polled by default
+BURST_INTERVAL = 5             # seconds between two fetches by default
+BURST_MIN_INTERVAL = 2         # seconds, the API spaces requests by over a second
+BURST_DURATION = 300           # seconds by default
+BURST_MAX_DURATION = 3600      # seconds at most
+
+# Derived values
+DERIVED_MAX_GAP = 900          # seconds between two readings beyond which energy isn't integrated
+
+# Validation
+VALIDATION_HOLD = 300          # seconds a rejected reading is replaced by the last accepted one, unknown after
+
+# Poll capture (opt-in)
+CAPTURE_KEY = DOMAIN + "_capture"
+CAPTURE_DIR = DOMAIN + "_captures" # in the configuration folder, one subfolder per inverter
+CAPTURE_SEGMENT_POLLS = 20     # polls per compressed segment
+CAPTURE_SEGMENTS = 72          # segments kept per inverter, oldest dropped first
+
+# Fleet aggregate
+FLEET_TYPE = "fleet"           # config entry data "type" of fleet aggregates
+FLEET_KEY = DOMAIN + "_fleets"
+
+# Discovery
+DISCOVERY_SUBNET = "192.168.1.0/24" # suggested when the local network is unknown
+DISCOVERY_MAX_HOSTS = 1024     # hosts scanned at most (a /22)
+DISCOVERY_CONCURRENCY = 64     # hosts checked at the same time
+DISCOVERY_TIMEOUT = 2          # seconds for a host to show its web interface
+DISCOVERY_PAGE_SIZE = 65536    # bytes of the web interface looked through
+DISCOVERY_LOGIN_TIMEOUT = 5    # seconds for the login check
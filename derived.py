@@ -0,0 +1,140 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+'''
+
+from __future__ import annotations
+
+from collections import deque
+import logging
+from typing import Any, Callable, Dict, Iterable
+
+from homeassistant.util import dt as dt_util # type: ignore
+
+from .const import *
+from .path import DERIVED_SENSORS, DERIVED_WINDOWS, KEY_CATEGORIES
+
+_LOGGER = logging.getLogger(__name__)
+
+# Derived keys of each source, by kind
+SOURCES: Dict[str, Dict[str, str]] = {}
+for _key, _val in DERIVED_SENSORS.items():
+    _kind = _val['kind'] + ("_" + _val['window'] if 'window' in _val else "")
+    SOURCES.setdefault(_val['source'], {})[_kind] = _key
+
+def segment(first: tuple, second: tuple) -> tuple:
+    """Return the (area, duration) two consecutive (time, value) samples add to a mean, nothing across a gap."""
+    duration = second[0] - first[0]
+    if not 0 < duration <= DERIVED_MAX_GAP: return 0., 0.
+    return (first[1] + second[1]) / 2 * duration, duration
+
+
+# DERIVED VALUES #
+class DerivedValues():
+    """
+    Energy counters, rolling means and daily extremes of a few power readings.
+
+    Updated in a single pass after each poll from the values already
+    fetched : power is integrated into energy with the trapezoidal rule
+    (not across gaps longer than DERIVED_MAX_GAP), rolling means are
+    weighted by time the same way (uneven polling, read-backs and bursts
+    don't skew them) and keep a running area and duration per window so
+    each update is O(1), and daily extremes reset at local midnight.
+    Only sources whose category was just fetched are updated. The whole
+    state can be saved and restored.
+    """
+
+    def __init__(self) -> None:
+        self.values: Dict[str, float] = {}             # derived key -> value
+        self._last: Dict[str, list] = {}               # source -> [time, value]
+        self._windows: Dict[str, deque] = {}           # mean key -> (time, value) samples
+        self._sums: Dict[str, list] = {}               # mean key -> [area, duration] between samples
+        self._day: str | None = None                   # local date of the extremes
+        return None
+
+    def update(self, value_of: Callable[[str], Any], now: float, categories: Iterable[str] | None = None) -> set:
+        """Take the current reading of the sources into account, return the derived keys that changed.
+
+        Only the sources of the given categories (every source by default) are read.
+        """
+        day = dt_util.as_local(dt_util.utc_from_timestamp(now)).date().isoformat()
+        if day != self._day: # New day, extremes start over
+            self._day = day
+            for keys in SOURCES.values():
+                self.values.pop(keys["min"], None)
+                self.values.pop(keys["max"], None)
+
+        before = dict(self.values)
+        for source, keys in SOURCES.items():
+            if categories is not None and KEY_CATEGORIES[source] not in categories: continue # Not a new reading
+            try:
+                value = float(value_of(source))
+            except (TypeError, ValueError):
+                continue # Not fetched (yet) or not supported
+
+            # Trapezoidal integration, forward and reverse flows apart
+            last = self._last.get(source)
+            if last is not None and 0 < now - last[0] <= DERIVED_MAX_GAP:
+                hours = (now - last[0]) / 3600
+                energy = keys["energy"]
+                self.values[energy] = self.values.get(energy, 0.) + (max(value, 0.) + max(last[1], 0.)) / 2 * hours
+                if "energy_reverse" in keys:
+                    reverse = keys["energy_reverse"]
+                    self.values[reverse] = self.values.get(reverse, 0.) + (max(-value, 0.) + max(-last[1], 0.)) / 2 * hours
+            self._last[source] = [now, value]
+
+            # Rolling means, weighted by time
+            for window, seconds in DERIVED_WINDOWS.items():
+                key = keys["mean_" + window]
+                samples = self._windows.setdefault(key, deque())
+                sums = self._sums.setdefault(key, [0., 0.])
+                if samples: self._add(sums, segment(samples[-1], (now, value)), 1)
+                samples.append((now, value))
+                cutoff = now - seconds
+                while len(samples) > 1 and samples[1][0] <= cutoff:
+                    self._add(sums, segment(samples.popleft(), samples[0]), -1)
+
+                # Only the share of the oldest segment within the window counts
+                area, duration = sums
+                if len(samples) > 1 and samples[0][0] < cutoff:
+                    front_area, front_duration = segment(samples[0], samples[1])
+                    if front_duration:
+                        outside = (cutoff - samples[0][0]) / front_duration
+                        area -= front_area * outside
+                        duration -= front_duration * outside
+                self.values[key] = area / duration if duration > 1e-6 else value
+
+            # Daily extremes
+            self.values[keys["min"]] = min(value, self.values.get(keys["min"], value))
+            self.values[keys["max"]] = max(value, self.values.get(keys["max"], value))
+
+        return {key for key, value in self.values.items() if before.get(key) != value}
+
+    @staticmethod
+    def _add(sums: list, part: tuple, sign: int) -> None:
+        sums[0] += sign * part[0]
+        sums[1] += sign * part[1]
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the whole state as a JSON serializable object."""
+        return {
+            "values": self.values,
+            "last": self._last,
+            "windows": {key: list(samples) for key, samples in self._windows.items()},
+            "day": self._day,
+        }
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        """Load a state saved with as_dict."""
+        self.values = {key: value for key, value in state.get("values", {}).items() if key in DERIVED_SENSORS}
+        self._last = {key: value for key, value in state.get("last", {}).items() if key in SOURCES}
+        self._windows = {key: deque(tuple(sample) for sample in samples)
+                         for key, samples in state.get("windows", {}).items() if key in DERIVED_SENSORS}
+        self._sums = {}
+        for key, samples in self._windows.items():
+            parts = [segment(first, second) for first, second in zip(samples, list(samples)[1:])]
+            self._sums[key] = [sum(area for area, _ in parts), sum(duration for _, duration in parts)]
+        self._day = state.get("day")
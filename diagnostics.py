@@ -0,0 +1,41 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+'''
+
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data # type: ignore
+from homeassistant.config_entries import ConfigEntry               # type: ignore
+from homeassistant.core import HomeAssistant                       # type: ignore
+
+from .const import DOMAIN, FLEET_TYPE
+from .inverter import InverterCoordinator
+from .fleet import FleetAggregate
+
+TO_REDACT = {"username", "password"}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict[str, Any]:
+    """Return the polling performance of an inverter, and of the whole fleet."""
+    if entry.data.get("type") == FLEET_TYPE:
+        return {"entry": dict(entry.data), "aggregate": FleetAggregate.get_all(hass)[entry.entry_id].as_dict()}
+
+    IC: InverterCoordinator = hass.data[DOMAIN][entry.entry_id]
+
+    return {
+        "entry": async_redact_data(dict(entry.data), TO_REDACT),
+        "stats": IC.stats.as_dict(),
+        "breaker": IC.breaker.as_dict(),
+        "fleet": IC.scheduler.stats(),
+        "data_time": IC.data_time,
+        "stale": IC.stale,
+        "capabilities": IC.capabilities,
+        "burst": IC.burst,
+        "capture": IC.capture.as_dict() if IC.capture is not None else None,
+    }
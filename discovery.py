@@ -0,0 +1,91 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+'''
+
+from __future__ import annotations
+
+import asyncio
+import async_timeout
+import ipaddress
+import logging
+import time
+
+import aiohttp
+from imeon_inverter_api.inverter import Inverter # type: ignore
+from homeassistant.core import HomeAssistant     # type: ignore
+
+from .const import *
+from .session import SessionPool
+
+_LOGGER = logging.getLogger(__name__)
+
+def subnet_hosts(subnet: str) -> list:
+    """Return every host address of a subnet ("192.168.1.0/24", a single address also works).
+
+    Raises ValueError if the subnet is invalid or has more than DISCOVERY_MAX_HOSTS hosts.
+    """
+    network = ipaddress.ip_network(subnet.strip(), strict=False)
+    if network.num_addresses > DISCOVERY_MAX_HOSTS + 2: # Network and broadcast addresses
+        raise ValueError(f"{subnet} has more than {DISCOVERY_MAX_HOSTS} hosts")
+    return [str(host) for host in network.hosts()] or [str(network.network_address)]
+
+
+# DISCOVERY #
+async def async_fingerprint(session: aiohttp.ClientSession, address: str) -> bool:
+    """Return whether the web interface of an Imeon inverter answers at an address."""
+    try:
+        async with session.get("http://" + address + "/", allow_redirects=True) as response:
+            if response.status != 200: return False
+            page = await response.content.read(DISCOVERY_PAGE_SIZE)
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+        return False
+    return b"imeon" in page.lower()
+
+async def async_scan(subnet: str, port: int = 80, concurrency: int = DISCOVERY_CONCURRENCY,
+                     timeout: float = DISCOVERY_TIMEOUT) -> list:
+    """
+    Look for Imeon inverters on a subnet, return their addresses.
+
+    Every host is checked at the same time, at most `concurrency` at once,
+    each within `timeout` seconds : hosts that don't answer only cost one
+    connection attempt, so scanning a /24 takes a few seconds at most.
+    Addresses are "host", or "host:port" when not on port 80.
+    """
+    hosts = subnet_hosts(subnet)
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+
+    connector = aiohttp.TCPConnector(limit=concurrency, force_close=True)
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+
+        async def check(host: str) -> str | None:
+            address = host if port == 80 else f"{host}:{port}"
+            async with semaphore:
+                return address if await async_fingerprint(session, address) else None
+
+        found = [address for address in await asyncio.gather(*(check(host) for host in hosts)) if address]
+
+    _LOGGER.info(f"Scanned {len(hosts)} hosts of {subnet} in {time.perf_counter() - start:.1f}s, found {found}")
+    return found
+
+async def async_check_login(hass: HomeAssistant, address: str, username: str, password: str) -> str | None:
+    """Log in once to an inverter, return None on success or the error key to show."""
+    api = Inverter(address)
+    SessionPool.get(hass).attach(api)
+    try:
+        async with async_timeout.timeout(DISCOVERY_LOGIN_TIMEOUT):
+            response = await api._client.login(username, password, timeout=DISCOVERY_LOGIN_TIMEOUT, check=True)
+    except Exception as e:
+        _LOGGER.debug(f"Login check at {address} failed: {e}")
+        return "cannot_connect"
+    finally:
+        await api._client.close_session()
+
+    if isinstance(response, dict) and response.get("accessGranted") is False:
+        return "invalid_auth"
+    return None
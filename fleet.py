@@ -0,0 +1,187 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+'''
+
+from __future__ import annotations
+
+from functools import partial
+import logging
+from typing import Any, Dict
+
+from homeassistant.core import HomeAssistant, CALLBACK_TYPE, callback # type: ignore
+
+from .const import *
+from .inverter import InverterCoordinator
+from .path import DECODERS, FLEET_EXTREMES, FLEET_SENSORS, FLEET_SUMS, SLOTS
+
+_LOGGER = logging.getLogger(__name__)
+
+# Member keys the fleet listens to
+FLEET_SOURCES = list(dict.fromkeys([*FLEET_SUMS, *FLEET_EXTREMES, "battery_soc", "battery_stored"]))
+
+# FLEET AGGREGATE #
+class FleetAggregate():
+    """
+    Virtual HUB summing up several inverters.
+
+    Listens to the data keys of its member HUBs (every inverter if no
+    member is given) and updates incrementally : when a member value
+    changes, each total is only adjusted by the difference with that
+    member's previous value. Battery SOC is weighted by capacity, the
+    capacity of each member being inferred from its stored energy and
+    SOC. Entities are notified once per member poll, not once per key.
+    """
+
+    def __init__(self, hass: HomeAssistant, uuid: str, title: str, members: list | None = None) -> None:
+        self.hass = hass
+        self.uuid = str(uuid)
+        self.friendly_name = title
+        self.members = set(members or []) # Empty means every inverter
+
+        self.values: Dict[str, float | None] = {key: None for key in FLEET_SENSORS}
+        self._member_values: Dict[str, Dict[str, float]] = {} # member id -> source -> value
+        self._unsubs: Dict[str, list] = {}                    # member id -> listener removers
+        self._sums: Dict[str, float] = {}                     # source -> total
+        self._counts: Dict[str, int] = {}                     # source -> members reporting it
+        self._soc: Dict[str, tuple] = {}                      # member id -> (stored, capacity)
+        self._capacity: Dict[str, float] = {}                 # member id -> last inferred capacity
+        self._stored_total = self._capacity_total = 0.
+
+        self._key_listeners: Dict[str, list] = {}             # fleet key -> entity callbacks
+        self._changed: set = set()
+        self._flush_scheduled = False
+        return None
+
+    @staticmethod
+    @callback
+    def get_all(hass: HomeAssistant) -> Dict[str, FleetAggregate]:
+        """Return every fleet aggregate of this Home Assistant instance, by entry id."""
+        return hass.data.setdefault(FLEET_KEY, {})
+
+    def includes(self, uuid: str) -> bool:
+        return not self.members or str(uuid) in self.members
+
+    # MEMBERS #
+    @callback
+    def attach(self, IC: InverterCoordinator) -> None:
+        """Start following a member HUB (replacing any previous HUB with the same id)."""
+        uuid = str(IC.id)
+        self.detach(uuid)
+        self._unsubs[uuid] = [IC.async_add_key_listener(source, partial(self._member_changed, IC, source))
+                              for source in FLEET_SOURCES]
+        for source in FLEET_SOURCES:
+            self._member_changed(IC, source)
+
+    @callback
+    def detach(self, uuid: str) -> None:
+        """Stop following a member HUB and take its values out of the totals."""
+        uuid = str(uuid)
+        for unsub in self._unsubs.pop(uuid, []): unsub()
+        for source in list(self._member_values.get(uuid, {})):
+            self._set(uuid, source, None)
+        self._member_values.pop(uuid, None)
+        self._capacity.pop(uuid, None)
+
+    @callback
+    def async_close(self) -> None:
+        for uuid in list(self._unsubs): self.detach(uuid)
+
+    @callback
+    def _member_changed(self, IC: InverterCoordinator, source: str) -> None:
+        try:
+            value = DECODERS[source](IC.data[SLOTS[source]])
+        except (TypeError, ValueError):
+            value = None
+        self._set(str(IC.id), source, value)
+
+    # INCREMENTAL UPDATES #
+    def _set(self, uuid: str, source: str, value: float | None) -> None:
+        """Apply the new value of a member key to every aggregate depending on it."""
+        values = self._member_values.setdefault(uuid, {})
+        old = values.get(source)
+        if old == value: return None
+        if value is None: values.pop(source)
+        else: values[source] = value
+
+        if source in FLEET_SUMS:
+            self._sums[source] = self._sums.get(source, 0.) + (value or 0.) - (old or 0.)
+            self._counts[source] = self._counts.get(source, 0) + (value is not None) - (old is not None)
+            self._update("fleet_" + source, self._sums[source] if self._counts[source] else None)
+
+        if source in FLEET_EXTREMES:
+            reported = [member[source] for member in self._member_values.values() if source in member]
+            self._update(f"fleet_{source}_min", min(reported) if reported else None)
+            self._update(f"fleet_{source}_max", max(reported) if reported else None)
+
+        if source in ("battery_soc", "battery_stored"):
+            self._update_soc(uuid)
+
+        self._schedule_flush()
+
+    def _update_soc(self, uuid: str) -> None:
+        """Adjust the capacity-weighted SOC with the new battery readings of a member."""
+        values = self._member_values.get(uuid, {})
+        soc, stored = values.get("battery_soc"), values.get("battery_stored")
+        if soc is not None and stored is not None and soc >= 1: # Too imprecise near empty
+            self._capacity[uuid] = stored * 100 / soc
+        capacity = self._capacity.get(uuid)
+
+        new = (stored, capacity) if stored is not None and capacity else None
+        old = self._soc.pop(uuid, None)
+        if old is not None:
+            self._stored_total -= old[0]
+            self._capacity_total -= old[1]
+        if new is not None:
+            self._soc[uuid] = new
+            self._stored_total += new[0]
+            self._capacity_total += new[1]
+
+        if self._soc and self._capacity_total > 0:
+            self._update("fleet_battery_soc", min(100., self._stored_total * 100 / self._capacity_total))
+        else: # No capacity known yet, plain average
+            socs = [member["battery_soc"] for member in self._member_values.values() if "battery_soc" in member]
+            self._update("fleet_battery_soc", sum(socs) / len(socs) if socs else None)
+
+    def _update(self, key: str, value: float | None) -> None:
+        if self.values[key] == value: return None
+        self.values[key] = value
+        self._changed.add(key)
+
+    # LISTENERS #
+    @callback
+    def async_add_key_listener(self, key: str, update_callback: CALLBACK_TYPE) -> CALLBACK_TYPE:
+        """Listen for changes of a single fleet key, return a callable removing the listener."""
+        listeners = self._key_listeners.setdefault(key, [])
+        listeners.append(update_callback)
+
+        @callback
+        def remove_listener() -> None:
+            listeners.remove(update_callback)
+
+        return remove_listener
+
+    def _schedule_flush(self) -> None:
+        """Notify entities once every key of a member poll has been applied."""
+        if self._flush_scheduled or not self._changed: return None
+        self._flush_scheduled = True
+        self.hass.loop.call_soon(self._flush)
+
+    @callback
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+        changed, self._changed = self._changed, set()
+        for key in changed:
+            for update_callback in list(self._key_listeners.get(key, ())):
+                update_callback()
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the fleet state as a JSON serializable object."""
+        return {
+            "members": sorted(self._member_values),
+            "values": self.values,
+            "capacities": self._capacity,
+        }
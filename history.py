@@ -0,0 +1,139 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+'''
+
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta
+import logging
+import time
+from typing import Any, Dict, List, Tuple
+
+from homeassistant.components.recorder.models import StatisticData, StatisticMetaData # type: ignore
+from homeassistant.components.recorder.statistics import async_add_external_statistics # type: ignore
+from homeassistant.core import HomeAssistant                                           # type: ignore
+from homeassistant.helpers.storage import Store                                        # type: ignore
+from homeassistant.util import dt as dt_util                                           # type: ignore
+
+from .const import *
+from .path import GET_REQUESTS, KEY_CATEGORIES
+
+_LOGGER = logging.getLogger(__name__)
+
+HOUR = 3600 # seconds
+
+def parse_series(series: Any, now: float) -> List[Tuple[float, float]]:
+    """
+    Turn a monitoring history series into (timestamp, value) samples.
+
+    Accepts lists of {"time"|"date"|"timestamp": ..., "value": ...}, or
+    lists of values for the evenly sized slots of the reported day
+    (HISTORY_TIME) from local midnight on, each placed at the start of its
+    slot. Slots not over yet are left out. Anything else (such as a single
+    total) can't be placed in time.
+    """
+    if not isinstance(series, list) or not series: return []
+
+    # Slots of the reported day, as the inverter splits it
+    today = dt_util.as_local(dt_util.utc_from_timestamp(now)).date()
+    day_start = dt_util.start_of_local_day(today).timestamp()
+    step = (dt_util.start_of_local_day(today + timedelta(days=1)).timestamp() - day_start) / len(series)
+
+    samples = []
+    for i, item in enumerate(series):
+        if isinstance(item, dict):
+            stamp = item.get("time", item.get("date", item.get("timestamp")))
+            if isinstance(stamp, (int, float)):
+                stamp = stamp / 1000 if stamp > 1e11 else stamp # ms or s
+            else:
+                parsed = dt_util.parse_datetime(str(stamp))
+                if parsed is None: continue
+                stamp = dt_util.as_utc(parsed).timestamp()
+            value = item.get("value")
+        else:
+            stamp, value = day_start + i * step, item
+            if stamp + step > now: break # Not over yet
+        try:
+            samples.append((float(stamp), float(value)))
+        except (TypeError, ValueError):
+            continue
+    return samples
+
+
+# HISTORY IMPORTER #
+class HistoryImporter():
+    """
+    Incremental backfill of long-term statistics from the monitoring history.
+
+    On first setup and on every reconnection the inverter's monitoring
+    history is fetched, split in complete hours, and every hour newer than
+    the last one imported is added to external long-term statistics
+    (`imeon_inverter:<entry id>_<key>`, separate from the sensors' own)
+    in a single bulk call per key. The last imported hour (and
+    running sum) of each key is kept on disk so nothing is imported twice.
+    """
+
+    def __init__(self, hass: HomeAssistant, uuid: str, name: str) -> None:
+        self.hass = hass
+        self.uuid = str(uuid)
+        self.name = name
+        self._store = Store(hass, HISTORY_STORE_VERSION, HISTORY_STORE_KEY + self.uuid)
+        self._last: Dict[str, Dict[str, float]] | None = None # key -> {"start", "sum"}
+        self._lock = asyncio.Lock()
+        return None
+
+    def statistic_id(self, key: str) -> str:
+        return f"{DOMAIN}:{self.uuid.lower()}_{key}"
+
+    async def async_backfill(self, api) -> int:
+        """Import every complete hour not imported yet, return the number of rows added."""
+        async with self._lock:
+            if self._last is None:
+                self._last = (await self._store.async_load() or {}).get("last", {})
+
+            history = (await api._client.get_data_monitoring(time=HISTORY_TIME)).get("result", {})
+            now = time.time()
+            added = 0
+
+            for key, info in GET_REQUESTS.items():
+                if info.get('statistics') != 'sum': continue
+                field = key[len(KEY_CATEGORIES[key]) + 1:]
+
+                # Energy per complete hour
+                hourly: Dict[float, float] = {}
+                for stamp, value in parse_series(history.get(field), now):
+                    start = stamp - stamp % HOUR
+                    if now - HISTORY_WINDOW <= start and start + HOUR <= now: # Only hours fully covered
+                        hourly[start] = hourly.get(start, 0.) + value
+
+                last = self._last.get(key, {"start": 0., "sum": 0.})
+                total = last["sum"]
+                rows = []
+                for start in sorted(hourly):
+                    if start <= last["start"]: continue
+                    total += hourly[start]
+                    rows.append(StatisticData(start=dt_util.utc_from_timestamp(start),
+                                              state=hourly[start], sum=total))
+                if not rows: continue
+
+                metadata = StatisticMetaData(
+                    has_mean=False,
+                    has_sum=True,
+                    name=f"{self.name} {info['friendly_name']}",
+                    source=DOMAIN,
+                    statistic_id=self.statistic_id(key),
+                    unit_of_measurement=info.get('unit'),
+                )
+                async_add_external_statistics(self.hass, metadata, rows)
+                self._last[key] = {"start": rows[-1]["start"].timestamp(), "sum": total}
+                added += len(rows)
+
+            if added:
+                self._store.async_delay_save(lambda: {"last": self._last}, 0)
+            _LOGGER.debug(f"{self.name} | Imported {added} hourly statistics from history")
+            return added
@@ -8,16 +8,34 @@ July 2024
 
 from __future__ import annotations
 
+import asyncio
 import async_timeout
+from collections import deque
 from datetime import timedelta
+import hashlib
+from json import dumps, loads
 import logging
+import time
 from typing import Any, Dict
 
 from imeon_inverter_api.inverter import Inverter                           # type: ignore
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator # type: ignore
-from homeassistant.core import HomeAssistant                               # type: ignore
+from homeassistant.core import HomeAssistant, CALLBACK_TYPE, Event, callback # type: ignore
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP                   # type: ignore
+from homeassistant.helpers.event import async_track_time_interval, async_call_later # type: ignore
+from homeassistant.helpers.storage import Store                            # type: ignore
 
 from .const import *
+from .session import SessionPool
+from .scheduler import FleetScheduler
+from .stats import HubStats
+from .writer import WriteQueue
+from .history import HistoryImporter
+from .capabilities import CapabilityCache, PROBE_CATEGORIES, build_profile, endpoint_missing
+from .breaker import CircuitBreaker, HALF_OPEN, OPEN, async_reachable
+from .derived import DerivedValues
+from .capture import PollCapture
+from .path import GET_CATEGORIES, GET_REQUESTS, KEY_CATEGORIES, REFRESH_TIERS, SLOTS, CATEGORY_SLOTS, DERIVED_CATEGORIES, VALIDATION, CATEGORY_VALIDATION
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -31,6 +49,71 @@ class InverterCoordinator(DataUpdateCoordinator):
     settings then all poll data from their HUB. Each inverter is it's own HUB
     thus it's own data set. This allows this integration to handle as many
     inverters as possible in parallel.
+
+    Data is split in categories (see path.py), each with its own refresh
+    tier. The coordinator polls at the pace of the fastest tier and only
+    fetches the categories that are due, so static data such as the
+    serial number isn't requested as often as live power values.
+
+    Data is kept as a flat list with one slot per key (see SLOTS in
+    path.py), raw payloads being stored through a precomputed
+    (category, field) -> slot table. Entities hold their slot index and
+    subscribe to it : after each poll only the entities whose slots
+    actually changed are notified, along with those whose write
+    heartbeat (see path.py) is due so it is enforced even for steady values.
+
+    HTTP connections come from a pool shared by every HUB and the login
+    session is kept (and persisted) for as long as it stays valid.
+    Polls of every HUB go through the fleet scheduler, which caps how
+    many run at once and spreads them over the polling interval.
+
+    The last known data is saved to disk regularly and loaded back on
+    startup (flagged as stale) so entities don't stay unknown while the
+    inverter answers the first requests.
+
+    Timings and outcomes of every poll are kept in `stats` for the
+    diagnostic entities and the diagnostics download. Setting changes
+    go through `writer`, which merges bursts into single requests, then
+    only the categories holding the affected keys are read back.
+
+    Timeline events are ingested incrementally : only events newer than
+    the last one seen are added to a fixed-size ring buffer, and each of
+    them is fired once as a Home Assistant event. Smartload is kept as
+    a versioned snapshot with a content hash.
+
+    On first setup and after each reconnection, the monitoring history is
+    imported into external long-term statistics, so energy produced while
+    offline isn't lost (see history.py).
+
+    What the inverter supports (phases, meter, relay, smartload) is probed
+    once per serial number and cached : categories, entities and services
+    it lacks are left out instead of failing on every poll or call. The
+    probe runs in the background, entities depending on a capability are
+    only added once it is over.
+
+    Unreachable inverters trip a circuit breaker : polling stops, then
+    resumes with an exponential backoff, each attempt being preceded by a
+    cheap TCP check so dead inverters don't hold sockets or poll slots.
+
+    A burst can be started on demand : a few keys are then read back every
+    few seconds for a limited time, on top of the normal polling.
+
+    New readings are checked against the bounds and maximum rates of
+    change declared in GET_REQUESTS in a single pass per poll : glitches
+    are held back (the last accepted value stays) and counted in `stats`.
+
+    Energy counters, rolling means and daily extremes of the main power
+    readings are derived after each poll (see derived.py) and saved
+    along with the snapshot.
+
+    When recording is enabled (`record: true` in the YAML configuration)
+    the raw payloads and timings of every fetch are kept in `capture`, a
+    compressed on-disk ring that can be replayed offline (see capture.py).
+
+    There is a single HUB per config entry : it is created when the entry
+    is set up and closed when it is unloaded (timers, background tasks,
+    listeners and HTTP session included), so reloading an entry never
+    leaves a previous HUB polling in the background.
     """
    
     _HUBs : Dict[InverterCoordinator] = {} 
@@ -45,30 +128,103 @@ class InverterCoordinator(DataUpdateCoordinator):
             # Name of the data. For logging purposes.
             name=HUBNAME,
             # Polling interval. Will only be polled if there are subscribers.
-            update_interval=timedelta(minutes=1),
+            update_interval=timedelta(seconds=min(REFRESH_TIERS.values())),
             always_update=True
         )
+        self.pool = SessionPool.get(hass)
+        self.scheduler = FleetScheduler.get(hass)
+        self.stats = HubStats()
+        self._interval = min(REFRESH_TIERS.values())
+        self.breaker = CircuitBreaker(title, self._interval)
         self.api = Inverter(user_input["address"]) # API calls
+        self.pool.attach(self.api, self.stats)
+        self.guard_rate_limiter()
+        self.writer = WriteQueue(hass, lambda: self.api, self.async_refresh_keys, self._async_create_task)
         self.username = user_input["username"]
         self.password = user_input["password"]
         self.friendly_name = title
+        self._login_time = None # Until a saved session was looked up
 
         # unique ID
         self.__id = uuid
         InverterCoordinator._HUBs[str(self.__id)] = self
 
-        # Store request data
-        self.data = {}
+        # Store request data, one slot per key
+        self.data: list = [None] * len(SLOTS)
         self.first_call = True
+        self.stale = False      # Data comes from a snapshot, not from the inverter
+        self.data_time = None   # Timestamp of the newest data
+        self._snapshot_store = Store(hass, SNAPSHOT_STORE_VERSION, SNAPSHOT_STORE_KEY + str(uuid))
+
+        # Timeline events, newest first
+        self.timeline: deque = deque(maxlen=TIMELINE_BUFFER_SIZE)
+        self._timeline_mark = None # Newest event seen so far
+        self.data[SLOTS["timeline"]] = self.timeline
+
+        # Last accepted reading of validated keys, slot -> (time, raw, value)
+        self._accepted: Dict[int, tuple] = {}
+
+        # Values derived from power readings
+        self.derived = DerivedValues()
+
+        # Burst polling, None when not running
+        self.burst: Dict[str, Any] | None = None
+        self._burst_unsubs: list = []
+        self._burst_running = False
+
+        # Capability profile, None until probed (everything is assumed supported)
+        self.capabilities: Dict[str, Any] | None = None
+        self._probe_task: asyncio.Task | None = None # Probe running in the background
+        self._probe_listeners: list = []             # Called once the probe is over
+
+        # Raw payloads of every fetch, for offline replay (opt-in)
+        self.capture = PollCapture(hass, uuid, title) if hass.data.get(CAPTURE_KEY) else None
+
+        # Long-term statistics backfill, run again after each disconnection
+        self.history = HistoryImporter(hass, uuid, title)
+        self._disconnected = False
+
+        # Smartload, versioned so callers can skip unchanged payloads
+        self.smartload = {"version": 0, "hash": None, "last_changed": None, "data": {}}
+        self._last_fetch: Dict[str, float] = {} # category -> monotonic time
+        self._key_listeners: list = [[] for _ in SLOTS] # slot -> entity callbacks
+        self._changed_keys: set = set()
+        self._heartbeats: Dict[int, float] = {} # slot -> monotonic time its next heartbeat write is due
+        self._tasks: set = set() # Background tasks, cancelled on close
 
         return None
-    
-    def update(self, user_input: dict[str, Any]) -> None:
-        """Update HUB data based on user input."""
-        self.api = Inverter(user_input["address"])
-        self.username = user_input["username"]
-        self.password = user_input["password"]
-        self.first_call = True
+
+    async def async_close(self) -> None:
+        """Stop every activity of this HUB and release what it holds."""
+        await self.async_shutdown() # No more scheduled polls
+        self.async_stop_burst()
+        self.writer.async_close()
+        for task in list(self._tasks): task.cancel()
+        if self._tasks: await asyncio.wait(self._tasks)
+
+        # Last known data for the next setup (e.g. after a reload)
+        if self.data_time is not None:
+            await self._snapshot_store.async_save(self.snapshot())
+        if self.capture is not None:
+            await self.capture.async_close()
+
+        self._key_listeners = [[] for _ in SLOTS]
+        await self.api._client.close_session() # The shared connector stays open
+        if InverterCoordinator._HUBs.get(str(self.__id)) is self:
+            del InverterCoordinator._HUBs[str(self.__id)]
+
+    @callback
+    def _async_create_task(self, target) -> asyncio.Task:
+        """Run a coroutine in the background, cancelled if the HUB is closed first."""
+        task = self.hass.async_create_task(target)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    @staticmethod
+    def clock() -> float:
+        """Return the monotonic time entities measure the age of their last write with."""
+        return time.monotonic() # NOTE driven by the capture's clock on replay (see benchmarks/replay.py)
 
     @property
     def id(self):
@@ -81,20 +237,475 @@ class InverterCoordinator(DataUpdateCoordinator):
         except:
             raise Exception("Incorrect HUB ID (" + str(id) + ") .") from None
         
-    def store_data(self, entity_dict):
-        # Store in data for entities to use
+    def store_data(self, entity_dict) -> set:
+        """Store API data for entities to use, return the set of slots that changed."""
+        data = self.data
+        changed = set()
         for key in entity_dict.keys():
-            if key != 'timeline':
-                val = entity_dict[key]
-                for sub_key, sub_val in val.items():
-                    self.data[key + "_" + sub_key] = sub_val
-            else: # Timeline is a list not a dict
-                self.data[key] = entity_dict[key]
+            if key == 'timeline': # Timeline is a list not a dict
+                if self.ingest_timeline(entity_dict[key]): changed.add(SLOTS[key])
+            elif key == 'smartload': # Smartload is kept whole and versioned
+                if self.ingest_smartload(entity_dict[key]): changed.add(SLOTS[key])
+            else:
+                slots = CATEGORY_SLOTS[key]
+                for sub_key, sub_val in entity_dict[key].items():
+                    slot = slots.get(sub_key)
+                    if slot is None: continue # Not used by any entity
+                    if data[slot] != sub_val:
+                        data[slot] = sub_val
+                        changed.add(slot)
+
+        self._changed_keys |= changed
+        return changed
+
+    @staticmethod
+    def event_mark(event: dict) -> str:
+        """Return a value identifying a timeline event."""
+        return dumps(event, sort_keys=True)
+
+    def ingest_timeline(self, timeline: list) -> bool:
+        """Add events newer than the last one seen to the buffer, return whether there were any."""
+        new = []
+        for event in timeline: # Newest first, stop at the last event seen
+            if not event: continue
+            if self.event_mark(event) == self._timeline_mark: break
+            new.append(event)
+        if not new: return False
+
+        # Events found on the very first poll are history, don't fire them
+        fire = self._timeline_mark is not None
+        self._timeline_mark = self.event_mark(new[0])
+        for event in reversed(new):
+            self.timeline.appendleft(event)
+            if fire:
+                self.hass.bus.async_fire(TIMELINE_EVENT, {"entry_id": self.__id,
+                                                          "inverter": self.friendly_name, **event})
+        return True
+
+    def ingest_smartload(self, smartload: dict) -> bool:
+        """Keep the smartload payload, bump its version if its content changed."""
+        content_hash = hashlib.sha1(dumps(smartload, sort_keys=True).encode()).hexdigest()
+        if content_hash == self.smartload["hash"]: return False
+
+        self.smartload = {
+            "version": self.smartload["version"] + 1,
+            "hash": content_hash,
+            "last_changed": time.time(),
+            "data": smartload,
+        }
+        return True
+
+    @callback
+    def async_add_key_listener(self, key: str, update_callback: CALLBACK_TYPE) -> CALLBACK_TYPE:
+        """Listen for changes of a single data key, return a callable removing the listener."""
+        listeners = self._key_listeners[SLOTS[key]]
+        listeners.append(update_callback)
+
+        @callback
+        def remove_listener() -> None:
+            listeners.remove(update_callback)
+
+        return remove_listener
+
+    @callback
+    def async_heartbeat_at(self, slot: int, due: float | None) -> None:
+        """Notify the entity bound to a slot once its heartbeat is due, even if unchanged (None cancels)."""
+        if due is None: self._heartbeats.pop(slot, None)
+        else: self._heartbeats[slot] = due
+
+    @callback
+    def async_update_listeners(self) -> None:
+        """Only notify the entities bound to slots that changed since the last notification."""
+        changed, self._changed_keys = self._changed_keys, set()
+        for slot in changed:
+            for update_callback in list(self._key_listeners[slot]):
+                update_callback()
     
+    async def async_login(self) -> None:
+        """Log in, unless the current (or a saved) session is still valid."""
+        api = self.api
+
+        # Look for a session saved before a restart
+        if self._login_time is None:
+            self._login_time = await self.pool.async_restore(api, self.__id) or 0.
+
+        if time.time() - self._login_time > SESSION_LIFETIME:
+            self.invalidate_session()
+
+        if not api._Inverter__auth_valid:
+            with self.stats.timer(self.stats.login):
+                await api.login(self.username, self.password)
+            self._login_time = time.time()
+            self.pool.save(api, self.__id)
+
+    def invalidate_session(self) -> None:
+        """Force a new login on the next poll."""
+        self.api._Inverter__auth_valid = False
+
+    def guard_rate_limiter(self) -> None:
+        """
+        Make failed requests give their API rate limiter slot back.
+
+        The client only frees its slot once a response arrived, so a request
+        that fails or times out would block every later one. The release is
+        done where every request of this HUB goes through (polls, probe,
+        login, read-backs, writes, history), whoever handles the error.
+        """
+        client = self.api._client
+        task = client.task
+
+        async def guarded_task(func, url, data):
+            async def request(url, data):
+                try:
+                    return await func(url, data=data)
+                except BaseException: # Timeouts cancel the request
+                    if not client._queue.empty(): client._queue.get_nowait() # Slot taken by this request
+                    raise
+            return await task(request, url, data)
+
+        client.task = guarded_task
+
+    def due_categories(self) -> list:
+        """Return the supported categories whose refresh tier has elapsed."""
+        now = time.monotonic()
+        slack = min(REFRESH_TIERS.values()) / 2 # Absorb polling jitter
+        due = []
+        for category, info in GET_CATEGORIES.items():
+            if not self.supports(info.get('requires')): continue
+            last = self._last_fetch.get(category)
+            if last is None or now - last >= REFRESH_TIERS[info["tier"]] - slack:
+                due.append(category)
+        return due
+
+    async def fetch_category(self, category: str) -> None:
+        """Fetch a single data category from the API and keep it in the API storage."""
+        client = self.api._client
+        storage = self.api._storage
+
+        match category:
+            case "inverter":
+                storage[category] = await client.get_data_onetime()
+            case "manager":
+                storage[category] = (await client.get_data_manager()).get("result", {})
+            case "monitoring":
+                storage[category] = (await client.get_data_monitoring(time='hour')).get("result", {})
+            case "monitoring_minute":
+                storage[category] = (await client.get_data_monitoring(time='minute')).get("result", {})
+            case "timeline":
+                storage[category] = await client.get_data_timeline()
+            case "smartload":
+                storage[category] = await client.get_data_smartload()
+            case _:
+                storage[category] = await self._fetch_timed(category)
+
+        self._last_fetch[category] = time.monotonic()
+
+    async def _fetch_timed(self, category: str) -> dict:
+        """Fetch a timed category on its own (the API only gathers them all at once)."""
+        client = self.api._client
+        url = "http://" + self.api.get_address() + "/" + GET_CATEGORIES[category]["endpoint"]
+        url += ("&" if "?" in url else "?") + "time=minute"
+
+        @client.build_request(method="GET", url=url, data="")
+        async def _request():
+            json = await _request.response.json()
+            return loads(json["result"])
+
+        return await _request()
+
+    async def fetch_and_store(self, categories: list) -> dict:
+        """Fetch the given categories one by one and store each as soon as it arrives."""
+        fetch_time = store_time = 0.
+        changed, fetched_categories = set(), []
+        captured = {} if self.capture is not None else None
+        started, error = time.time(), None
+        try:
+            for category in categories:
+                start = time.perf_counter()
+                await self.fetch_category(category)
+                fetched = time.perf_counter()
+                changed |= self.store_data({category: self.api._storage[category]})
+                fetched_categories.append(category)
+                self.data_time = time.time()
+                fetch_time += fetched - start
+                store_time += time.perf_counter() - fetched
+                if captured is not None:
+                    captured[category] = {"payload": self.api._storage[category], "fetch": round(fetched - start, 4)}
+        except BaseException as e: # Timeouts cancel the fetch
+            error = type(e).__name__ + ": " + str(e)
+            raise
+        finally:
+            start = time.perf_counter()
+            self.validate(changed, fetched_categories, time.time()) # Whatever was stored, even if a later category failed
+            self.stats.fetch.add(fetch_time)
+            self.stats.store.add(store_time + time.perf_counter() - start)
+            if captured is not None:
+                self.capture.add(started, time.time() - started, captured, error)
+
+        if DERIVED_CATEGORIES.intersection(fetched_categories): self.update_derived(fetched_categories)
+
+        # Entities whose heartbeat is due write their value again, even if unchanged
+        now = self.clock()
+        self._changed_keys.update(slot for slot, due in self._heartbeats.items() if due <= now)
+        return self.data
+
+    def validate(self, slots: set, categories: list, now: float) -> None:
+        """
+        Check the new readings of validated keys against their bounds and maximum rate, in one pass.
+
+        A rejected reading is replaced by the last accepted one for at most
+        VALIDATION_HOLD seconds, then by None (unknown). As the rate is
+        measured from the last accepted reading, a genuine step change is
+        accepted once enough time has passed for it to be plausible.
+        Readings fetched again unchanged are accepted as of now, so a
+        value steady for hours doesn't let any jump through.
+        """
+        data = self.data
+        accepted = self._accepted
+        for category in categories:
+            for slot in CATEGORY_VALIDATION[category]:
+                last = accepted.get(slot)
+                if slot not in slots and last is not None and data[slot] == last[1]:
+                    accepted[slot] = (now, last[1], last[2])
+
+        for slot in slots.intersection(VALIDATION):
+            _, key, scale, low, high, max_rate = VALIDATION[slot]
+            raw = data[slot]
+            try:
+                value = float(raw) * scale
+            except (TypeError, ValueError):
+                continue # Not a number, shown as unknown anyway
+
+            last = accepted.get(slot)
+            if not low <= value <= high: # Also rejects NaN
+                reason = "range"
+            elif max_rate is not None and last is not None and abs(value - last[2]) > max_rate * (now - last[0]):
+                reason = "rate"
+            else:
+                accepted[slot] = (now, raw, value)
+                continue
+
+            self.stats.rejected(key, value, reason)
+            data[slot] = last[1] if last is not None and now - last[0] <= VALIDATION_HOLD else None
+            _LOGGER.debug(f"{self.friendly_name} | Rejected {key} = {value} ({reason}), showing {data[slot]}")
+
+    def update_derived(self, categories: list) -> None:
+        """Compute the values derived from the categories just fetched, in one pass."""
+        data = self.data
+        for key in self.derived.update(lambda key: data[SLOTS[key]], time.time(), categories):
+            data[SLOTS[key]] = self.derived.values[key]
+            self._changed_keys.add(SLOTS[key])
+
+    async def async_refresh_keys(self, keys: set) -> None:
+        """Fetch only the categories holding the given keys, and notify their entities."""
+        categories = list(dict.fromkeys(KEY_CATEGORIES[key] for key in keys))
+        try:
+            async with self.scheduler.slot(self.friendly_name, self._interval), \
+                       async_timeout.timeout(TIMEOUT*2):
+                await self.async_login() # The session may have expired since the last poll
+                await self.fetch_and_store(categories)
+        except TimeoutError as e:
+            _LOGGER.error(str(self.friendly_name) + ' | Read-back Timeout Error: ' + str(e))
+            return None
+        except Exception as e:
+            self.invalidate_session() # Most likely an expired session cookie
+            _LOGGER.error(str(self.friendly_name) + ' | Read-back Error: ' + str(e))
+            return None
+
+        self.async_update_listeners()
+
+    # BURST POLLING #
+    @callback
+    def async_start_burst(self, keys: list, interval: float, duration: float) -> None:
+        """Read the given keys back every `interval` seconds, for `duration` seconds."""
+        self.async_stop_burst()
+        if duration <= 0: return None # Only stop the running burst
+
+        async def tick(now=None) -> None:
+            # Skip ticks while the previous fetch runs or the inverter is unreachable
+            if self._burst_running or self.breaker.state == OPEN: return None
+            self._burst_running = True
+            try:
+                await self.async_refresh_keys(keys)
+            finally:
+                self._burst_running = False
+
+        self._burst_unsubs = [
+            async_track_time_interval(self.hass, tick, timedelta(seconds=interval)),
+            async_call_later(self.hass, duration, self.async_stop_burst),
+        ]
+        self.burst = {"keys": sorted(keys), "interval": interval, "until": time.time() + duration}
+        _LOGGER.info(f"{self.friendly_name} | Burst polling of {self.burst['keys']} every {interval}s for {duration}s")
+
+    @callback
+    def async_stop_burst(self, *args) -> None:
+        """Stop the running burst, normal polling goes on."""
+        for unsub in self._burst_unsubs: unsub()
+        self._burst_unsubs = []
+        if self.burst is not None:
+            _LOGGER.info(f"{self.friendly_name} | Burst polling stopped")
+        self.burst = None
+
+    # CAPABILITIES #
+    def supports(self, requirement: str | None) -> bool:
+        """Return whether the inverter has a capability (assumed until probed)."""
+        if requirement is None or self.capabilities is None: return True
+        return requirement in self.capabilities["capabilities"]
+
+    async def async_setup_capabilities(self) -> None:
+        """Load the cached capability profile of this inverter, probe it in the background if unknown."""
+        cache = CapabilityCache.get(self.hass)
+        self.capabilities = await cache.async_get_entry(self.__id)
+        if self.capabilities is None:
+            self._probe_task = self._async_create_task(self.async_run_probe(cache))
+
+    async def async_run_probe(self, cache: CapabilityCache) -> None:
+        """Probe the inverter, cache its profile if complete, then call back whoever waits for it."""
+        try:
+            async with self.scheduler.slot(self.friendly_name, self._interval), \
+                       async_timeout.timeout(TIMEOUT*4):
+                self.capabilities = await self.async_probe(cache)
+        except Exception as e:
+            _LOGGER.warning(str(self.friendly_name) + ' | Capability probe failed, every entity is created: ' + str(e))
+
+        if self.capabilities is not None:
+            cache.save(self.__id, self.capabilities)
+            _LOGGER.info(f"{self.friendly_name} | Capabilities: {self.capabilities}")
+
+        self._probe_task = None
+        listeners, self._probe_listeners = self._probe_listeners, []
+        for probed_callback in listeners: probed_callback()
+
+    @callback
+    def async_when_probed(self, probed_callback: CALLBACK_TYPE) -> CALLBACK_TYPE:
+        """Call back once the probe is over (right away if not probing), return a callable cancelling it."""
+        if self._probe_task is None:
+            probed_callback()
+            return lambda: None
+        self._probe_listeners.append(probed_callback)
+
+        @callback
+        def remove_listener() -> None:
+            if probed_callback in self._probe_listeners: self._probe_listeners.remove(probed_callback)
+
+        return remove_listener
+
+    async def async_probe(self, cache: CapabilityCache) -> Dict[str, Any] | None:
+        """
+        Find out what the inverter supports, unless its serial number was already probed.
+
+        Returns None unless every probed endpoint answered, or is missing on
+        this model : a timeout or an error doesn't tell whether it exists,
+        so the inverter is probed again on the next startup.
+        """
+        await self.async_login()
+        await self.fetch_and_store(["inverter"])
+        serial = str(self.data[SLOTS["inverter_serial"]])
+        profile = await cache.async_get_serial(serial)
+        if profile is not None: return profile
+
+        payloads = {}
+        for category in PROBE_CATEGORIES:
+            try:
+                async with async_timeout.timeout(TIMEOUT):
+                    await self.fetch_and_store([category])
+                payloads[category] = self.api._storage[category]
+            except Exception as e:
+                if not endpoint_missing(e):
+                    _LOGGER.warning(str(self.friendly_name) + ' | Capability probe of ' + category
+                                    + ' failed, every entity is created: ' + str(e))
+                    return None
+                payloads[category] = None # Not on this model
+
+        return build_profile(serial, payloads)
+
+    # SNAPSHOT #
+    async def async_setup_snapshot(self) -> list:
+        """Load the last known data, then save it regularly and on shutdown.
+
+        Returns the callables that stop the saves.
+        """
+        snapshot = await self._snapshot_store.async_load()
+        if snapshot and self.data_time is None:
+            data = snapshot.get("data", {}) # Saved by key, slots may move between versions
+            self.ingest_timeline(data.pop("timeline", []))
+            for key, value in data.items():
+                if key in GET_REQUESTS: self.data[SLOTS[key]] = value
+            self.derived.restore(snapshot.get("derived", {}))
+            if snapshot.get("smartload"): self.smartload = snapshot["smartload"] # Versions go on counting after a restart
+            for key, value in self.derived.values.items():
+                self.data[SLOTS[key]] = value
+            self.data_time = snapshot.get("time")
+            self.stale = True
+            self._changed_keys |= set(range(len(SLOTS)))
+
+        @callback
+        def save(*args) -> None:
+            self._snapshot_store.async_delay_save(self.snapshot, 0)
+
+        return [
+            async_track_time_interval(self.hass, save, timedelta(seconds=SNAPSHOT_INTERVAL)),
+            self.hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, save),
+        ]
+
+    @callback
+    def snapshot(self) -> dict:
+        """Return a compact copy of the data (only what entities use) to be saved."""
+        data = {key: self.data[SLOTS[key]] for key in GET_REQUESTS if self.data[SLOTS[key]] is not None}
+        data["timeline"] = list(self.timeline)[:1]
+        return {"time": self.data_time, "data": data, "derived": self.derived.as_dict(),
+                "smartload": self.smartload if self.smartload["version"] else None}
+
     async def init_and_store(self) -> dict:
-        await self.api.init()
-        self.store_data(self.api._storage)
+        # Categories to poll are only known once probed
+        if self._probe_task is not None: await asyncio.wait([self._probe_task])
+
+        # Stagger first polls so every inverter doesn't start at once
+        await asyncio.sleep(self.scheduler.phase(self.__id, self._interval))
+        try:
+            async with self.scheduler.slot(self.friendly_name, self._interval):
+                await self.async_login()
+                await self.fetch_and_store(list(GET_CATEGORIES))
+                self.stats.poll_succeeded()
+                self.breaker.succeeded()
+        except TimeoutError as e:
+            self._disconnected = True # Regular polls fetch what's missing, history is imported then
+            self.stats.timeouts += 1
+            self.breaker.failed()
+            _LOGGER.error(str(self.friendly_name) + ' | Timeout Error: First poll failed, please check credentials.'
+                          + ' If the error persists check the network connection.')
+            return self.data
+        except Exception as e:
+            self._disconnected = True
+            self.stats.errors += 1
+            self.breaker.failed()
+            self.invalidate_session()
+            _LOGGER.error(str(self.friendly_name) + ' | First Poll Error: ' + str(e))
+            return self.data
+
+        self.clear_stale()
+        self.async_update_listeners() # Don't wait for the next poll to show initial data
+        await self.async_backfill_history()
         return self.data
+
+    def clear_stale(self) -> None:
+        """Drop the stale flag once every supported category was fetched from the inverter."""
+        if not self.stale: return None
+        for category, info in GET_CATEGORIES.items():
+            if self.supports(info.get('requires')) and category not in self._last_fetch: return None
+
+        # Data is fresh, entities showing snapshot values must drop the flag
+        self.stale = False
+        self._changed_keys |= set(range(len(SLOTS)))
+
+    async def async_backfill_history(self) -> None:
+        """Fill long-term statistics with the monitoring history not imported yet."""
+        try:
+            async with self.scheduler.slot(self.friendly_name, self._interval), \
+                       async_timeout.timeout(TIMEOUT*2):
+                await self.history.async_backfill(self.api)
+        except Exception as e:
+            _LOGGER.error(str(self.friendly_name) + ' | History Import Error: ' + str(e))
     
     # DATA UPDATES # 
     async def _async_update_data(self) -> Dict:
@@ -105,28 +716,61 @@ class InverterCoordinator(DataUpdateCoordinator):
         It also includes the login process. 
         """
 
+        if self.first_call:
+            # First call shouldn't slow down home assistant
+            self.first_call = False
+            self._async_create_task(self.init_and_store())
+            return self.data # Send empty data on init, avoids timeout
+
+        # Categories to poll are only known once probed
+        if self._probe_task is not None: return self.data
+
+        # Unreachable inverter : wait for the backoff, then make sure it answers before polling
+        if not self.breaker.allow():
+            self.update_interval = timedelta(seconds=self.breaker.retry_in())
+            return self.data
+        if self.breaker.state == HALF_OPEN and not await async_reachable(self.api.get_address()):
+            self.breaker.failed()
+            self.update_interval = timedelta(seconds=self.breaker.retry_in())
+            self._changed_keys.add(SLOTS[DIAGNOSTICS_KEY])
+            return self.data
+
+        # Keep this inverter on its own phase of the polling interval
+        self.update_interval = timedelta(seconds=self.scheduler.next_delay(self.__id, self._interval))
+
         try:
-            async with async_timeout.timeout(TIMEOUT*4):
+            async with self.scheduler.slot(self.friendly_name, self._interval), \
+                       async_timeout.timeout(TIMEOUT*4):
 
                 # Am I logged in ? If not log in
-                await self.api.login(self.username, self.password)
+                await self.async_login()
 
-                if self.first_call:
-                    # First call shouldn't slow down home assistant
-                    self.first_call = False
-                    self.hass.async_create_task(self.init_and_store())
-                    return self.data # Send empty data on init, avoids timeout
+                # Fetch due categories using distant API and store them for entities to use
+                await self.fetch_and_store(self.due_categories())
+                self.stats.poll_succeeded()
+                self.breaker.succeeded()
+            self.clear_stale()
 
-                # Fetch data using distant API
-                await self.api.update()
-
-                # Store in data for entities to use
-                self.store_data(self.api._storage)
+            # Reconnected, import what was missed in the meantime
+            if self._disconnected:
+                self._disconnected = False
+                self._async_create_task(self.async_backfill_history())
                     
         except TimeoutError as e:
+            self._disconnected = True
+            self.stats.timeouts += 1
+            self.breaker.failed()
             _LOGGER.error(str(self.friendly_name) + ' | Timeout Error: Reconnection failed, please check credentials.'
                           + ' If the error persists check the network connection.')
         except Exception as e:
+            self._disconnected = True
+            self.stats.errors += 1
+            self.breaker.failed()
+            self.invalidate_session() # Most likely an expired session cookie
             _LOGGER.error(str(self.friendly_name) + ' | Data Update Error: ' + str(e))
-                
+
+        if self.breaker.state == OPEN: # Don't wake up again before the backoff elapsed
+            self.update_interval = timedelta(seconds=self.breaker.retry_in())
+
+        self._changed_keys.add(SLOTS[DIAGNOSTICS_KEY]) # Diagnostic entities change on every poll
         return self.data # send stored data so entities can poll it
@@ -6,6 +6,9 @@ Rodrigue Lemaire
 July 2024
 '''
 
+from math import inf
+from typing import Any, Callable
+
 from voluptuous import All, Range, In
 
 def list_keys(dictn: dict, type: str) -> list:
@@ -15,30 +18,76 @@ def list_keys(dictn: dict, type: str) -> list:
         if v["type"]==type: result.append(k)
     return result
 
+# Refresh tiers (seconds between two fetches of the same category)
+# NOTE the fastest tier is also the coordinator's polling interval
+REFRESH_TIERS = {
+    "live": 30,
+    "normal": 60,
+    "slow": 300,
+    "static": 3600,
+}
+
+# Data categories as stored by the API, each one is fetched on its own tier
+# Timed categories also hold the endpoint used to fetch them one by one
+# Optional 'requires' : capability the inverter must have for the category to be fetched
+GET_CATEGORIES = {
+    "battery":           {'tier': 'live',   'endpoint': 'api/battery'},
+    "grid":              {'tier': 'normal', 'endpoint': 'api/grid?threephase=true'},
+    "input":             {'tier': 'normal', 'endpoint': 'api/input'},
+    "inverter":          {'tier': 'static'},
+    "manager":           {'tier': 'normal'},
+    "meter":             {'tier': 'live',   'endpoint': 'api/em', 'requires': 'meter'},
+    "output":            {'tier': 'normal', 'endpoint': 'api/output?threephase=true'},
+    "pv":                {'tier': 'live',   'endpoint': 'api/pv'},
+    "temp":              {'tier': 'slow',   'endpoint': 'api/temp'},
+    "monitoring":        {'tier': 'slow'},
+    "monitoring_minute": {'tier': 'normal'},
+    "timeline":          {'tier': 'normal'},
+    "smartload":         {'tier': 'slow',   'requires': 'smartload'},
+}
+
+# Readable names for raw inverter modes
+INVERTER_MODES = {
+    "SMG": "Smart Grid",
+    "BUP": "Backup",
+    "100": "On Grid",
+    "150": "Off Grid",
+}
+
 # Sensors & Text Entities
+# Optional decoding fields : 'scale' and 'round' for numbers, 'enum' for text
+# Optional 'statistics' : 'sum' for energy counters backfilled from the monitoring history
+# Optional write filtering for noisy numbers : changes within 'deadband_abs' (unit) or
+# 'deadband_rel' (share of the last written value) are only written once 'heartbeat' (seconds) has passed,
+# the value is written again every 'heartbeat' seconds even if unchanged
+# Optional 'requires' : capability the inverter must have for the entity to be created (see capabilities.py)
+# Optional 'derive' : power computed into energy, rolling means and daily extremes ('signed' also
+# integrates the reverse flow), see DERIVED_SENSORS
+# Optional validation : plausible 'min' and 'max' (unit) and 'max_rate' (unit per second) of decoded
+# values, readings outside of them are rejected by the coordinator (see VALIDATION)
 GET_REQUESTS = {
     # Battery
     "battery_autonomy": {'type': 'number', 'friendly_name': 'Battery Autonomy', 'unit': ''},
     "battery_charge_time": {'type': 'number', 'friendly_name': 'Battery Charge Time', 'unit': ''},
-    "battery_power": {'type': 'number', 'friendly_name': 'Battery Power', 'unit': 'W'},
-    "battery_soc": {'type': 'number', 'friendly_name': 'Battery SOC', 'unit': '%'},
+    "battery_power": {'type': 'number', 'friendly_name': 'Battery Power', 'unit': 'W', 'min': -20000, 'max': 20000, 'derive': 'signed'},
+    "battery_soc": {'type': 'number', 'friendly_name': 'Battery SOC', 'unit': '%', 'min': 0, 'max': 100, 'max_rate': 0.5},
     "battery_status": {'type': 'text', 'friendly_name': 'Battery Status'},
-    "battery_stored": {'type': 'number', 'friendly_name': 'Battery Stored', 'unit': 'Wh'},
+    "battery_stored": {'type': 'number', 'friendly_name': 'Battery Stored', 'unit': 'Wh', 'min': 0, 'max': 100000},
 
     # Grid
-    "grid_current_l1": {'type': 'number', 'friendly_name': 'Grid Current L1', 'unit': 'A'},
-    "grid_current_l2": {'type': 'number', 'friendly_name': 'Grid Current L2', 'unit': 'A'},
-    "grid_current_l3": {'type': 'number', 'friendly_name': 'Grid Current L3', 'unit': 'A'},
-    "grid_frequency": {'type': 'number', 'friendly_name': 'Grid Frequency', 'unit': 'Hz'},
-    "grid_voltage_l1": {'type': 'number', 'friendly_name': 'Grid Voltage L1', 'unit': 'V'},
-    "grid_voltage_l2": {'type': 'number', 'friendly_name': 'Grid Voltage L1', 'unit': 'V'},
-    "grid_voltage_l3": {'type': 'number', 'friendly_name': 'Grid Voltage L1', 'unit': 'V'},
+    "grid_current_l1": {'type': 'number', 'friendly_name': 'Grid Current L1', 'unit': 'A', 'min': -100, 'max': 100, 'deadband_abs': 0.1, 'deadband_rel': 0.02, 'heartbeat': 900},
+    "grid_current_l2": {'type': 'number', 'friendly_name': 'Grid Current L2', 'unit': 'A', 'min': -100, 'max': 100, 'deadband_abs': 0.1, 'deadband_rel': 0.02, 'heartbeat': 900, 'requires': 'three_phase'},
+    "grid_current_l3": {'type': 'number', 'friendly_name': 'Grid Current L3', 'unit': 'A', 'min': -100, 'max': 100, 'deadband_abs': 0.1, 'deadband_rel': 0.02, 'heartbeat': 900, 'requires': 'three_phase'},
+    "grid_frequency": {'type': 'number', 'friendly_name': 'Grid Frequency', 'unit': 'Hz', 'min': 0, 'max': 70, 'deadband_abs': 0.05, 'heartbeat': 900},
+    "grid_voltage_l1": {'type': 'number', 'friendly_name': 'Grid Voltage L1', 'unit': 'V', 'min': 0, 'max': 300, 'deadband_abs': 1, 'heartbeat': 900},
+    "grid_voltage_l2": {'type': 'number', 'friendly_name': 'Grid Voltage L1', 'unit': 'V', 'min': 0, 'max': 300, 'deadband_abs': 1, 'heartbeat': 900, 'requires': 'three_phase'},
+    "grid_voltage_l3": {'type': 'number', 'friendly_name': 'Grid Voltage L1', 'unit': 'V', 'min': 0, 'max': 300, 'deadband_abs': 1, 'heartbeat': 900, 'requires': 'three_phase'},
 
     # AC Input
-    "input_power_l1": {'type': 'number', 'friendly_name': 'Input Power L1', 'unit': 'W'},
-    "input_power_l2": {'type': 'number', 'friendly_name': 'Input Power L2', 'unit': 'W'},
-    "input_power_l3": {'type': 'number', 'friendly_name': 'Input Power L3', 'unit': 'W'},
-    "input_power_total": {'type': 'number', 'friendly_name': 'Input Power Total', 'unit': 'W'},
+    "input_power_l1": {'type': 'number', 'friendly_name': 'Input Power L1', 'unit': 'W', 'min': -30000, 'max': 30000},
+    "input_power_l2": {'type': 'number', 'friendly_name': 'Input Power L2', 'unit': 'W', 'min': -30000, 'max': 30000, 'requires': 'three_phase'},
+    "input_power_l3": {'type': 'number', 'friendly_name': 'Input Power L3', 'unit': 'W', 'min': -30000, 'max': 30000, 'requires': 'three_phase'},
+    "input_power_total": {'type': 'number', 'friendly_name': 'Input Power Total', 'unit': 'W', 'min': -30000, 'max': 30000},
 
     # Inverter settings
     "inverter_charging_current_limit": {'type': 'number', 'friendly_name': 'Charging Current Limit', 'unit': 'A'},
@@ -50,7 +99,7 @@ GET_REQUESTS = {
     "inverter_battery_night_discharge": {'type': 'text', 'friendly_name': 'Battery Night Discharge'},
 
     # Manager settings
-    "manager_inverter_mode": {'type': 'text', 'friendly_name': 'Inverter Mode'},
+    "manager_inverter_mode": {'type': 'text', 'friendly_name': 'Inverter Mode', 'enum': INVERTER_MODES},
     "manager_inverter_state": {'type': 'text', 'friendly_name': 'Inverter State'},
     "manager_relay_check": {'type': 'text', 'friendly_name': 'Relay Check'},
     "manager_relay_state": {'type': 'text', 'friendly_name': 'Relay State'},
@@ -58,43 +107,43 @@ GET_REQUESTS = {
 
     # Electric Meter
     "meter_active": {'type': 'text', 'friendly_name': 'Meter Active'},
-    "meter_power": {'type': 'number', 'friendly_name': 'Meter Power', 'unit': 'W'},
-    "meter_power_protocol": {'type': 'number', 'friendly_name': 'Meter Power Protocol', 'unit': 'W'},
+    "meter_power": {'type': 'number', 'friendly_name': 'Meter Power', 'unit': 'W', 'min': -50000, 'max': 50000, 'derive': 'signed'},
+    "meter_power_protocol": {'type': 'number', 'friendly_name': 'Meter Power Protocol', 'unit': 'W', 'min': -50000, 'max': 50000},
 
     # AC Output
-    "output_current_l1": {'type': 'number', 'friendly_name': 'Output Current L1', 'unit': 'A'},
-    "output_current_l2": {'type': 'number', 'friendly_name': 'Output Current L2', 'unit': 'A'},
-    "output_current_l3": {'type': 'number', 'friendly_name': 'Output Current L3', 'unit': 'A'},
-    "output_frequency": {'type': 'number', 'friendly_name': 'Output Frequency', 'unit': 'Hz'},
-    "output_power_l1": {'type': 'number', 'friendly_name': 'Output Power L1', 'unit': 'W'},
-    "output_power_l2": {'type': 'number', 'friendly_name': 'Output Power L2', 'unit': 'W'},
-    "output_power_l3": {'type': 'number', 'friendly_name': 'Output Power L3', 'unit': 'W'},
-    "output_power_total": {'type': 'number', 'friendly_name': 'Output Power Total', 'unit': 'W'},
-    "output_voltage_l1": {'type': 'number', 'friendly_name': 'Output Voltage L1', 'unit': 'V'},
-    "output_voltage_l2": {'type': 'number', 'friendly_name': 'Output Voltage L2', 'unit': 'V'},
-    "output_voltage_l3": {'type': 'number', 'friendly_name': 'Output Voltage L3', 'unit': 'V'},
+    "output_current_l1": {'type': 'number', 'friendly_name': 'Output Current L1', 'unit': 'A', 'min': -100, 'max': 100, 'deadband_abs': 0.1, 'deadband_rel': 0.02, 'heartbeat': 900},
+    "output_current_l2": {'type': 'number', 'friendly_name': 'Output Current L2', 'unit': 'A', 'min': -100, 'max': 100, 'deadband_abs': 0.1, 'deadband_rel': 0.02, 'heartbeat': 900, 'requires': 'three_phase'},
+    "output_current_l3": {'type': 'number', 'friendly_name': 'Output Current L3', 'unit': 'A', 'min': -100, 'max': 100, 'deadband_abs': 0.1, 'deadband_rel': 0.02, 'heartbeat': 900, 'requires': 'three_phase'},
+    "output_frequency": {'type': 'number', 'friendly_name': 'Output Frequency', 'unit': 'Hz', 'min': 0, 'max': 70, 'deadband_abs': 0.05, 'heartbeat': 900},
+    "output_power_l1": {'type': 'number', 'friendly_name': 'Output Power L1', 'unit': 'W', 'min': -30000, 'max': 30000},
+    "output_power_l2": {'type': 'number', 'friendly_name': 'Output Power L2', 'unit': 'W', 'min': -30000, 'max': 30000, 'requires': 'three_phase'},
+    "output_power_l3": {'type': 'number', 'friendly_name': 'Output Power L3', 'unit': 'W', 'min': -30000, 'max': 30000, 'requires': 'three_phase'},
+    "output_power_total": {'type': 'number', 'friendly_name': 'Output Power Total', 'unit': 'W', 'min': -30000, 'max': 30000, 'derive': 'positive'},
+    "output_voltage_l1": {'type': 'number', 'friendly_name': 'Output Voltage L1', 'unit': 'V', 'min': 0, 'max': 300, 'deadband_abs': 1, 'heartbeat': 900},
+    "output_voltage_l2": {'type': 'number', 'friendly_name': 'Output Voltage L2', 'unit': 'V', 'min': 0, 'max': 300, 'deadband_abs': 1, 'heartbeat': 900, 'requires': 'three_phase'},
+    "output_voltage_l3": {'type': 'number', 'friendly_name': 'Output Voltage L3', 'unit': 'V', 'min': 0, 'max': 300, 'deadband_abs': 1, 'heartbeat': 900, 'requires': 'three_phase'},
 
     # Solar Panel
     "pv_consumed": {'type': 'number', 'friendly_name': 'PV Consumed', 'unit': 'Wh'},
     "pv_injected": {'type': 'number', 'friendly_name': 'PV Injected', 'unit': 'Wh'},
-    "pv_power_1": {'type': 'number', 'friendly_name': 'PV Power 1', 'unit': 'W'},
-    "pv_power_2": {'type': 'number', 'friendly_name': 'PV Power 2', 'unit': 'W'},
-    "pv_power_total": {'type': 'number', 'friendly_name': 'PV Power Total', 'unit': 'W'},
+    "pv_power_1": {'type': 'number', 'friendly_name': 'PV Power 1', 'unit': 'W', 'min': -100, 'max': 30000},
+    "pv_power_2": {'type': 'number', 'friendly_name': 'PV Power 2', 'unit': 'W', 'min': -100, 'max': 30000},
+    "pv_power_total": {'type': 'number', 'friendly_name': 'PV Power Total', 'unit': 'W', 'min': -100, 'max': 30000, 'derive': 'positive'},
     #"pv_stored": {'type': 'number', 'friendly_name': 'PV Stored', 'unit': ''}, # Avoid, confusing entry
     
     # Temperature
-    "temp_air_temperature": {'type': 'number', 'friendly_name': 'Air Temperature', 'unit': '°C'},
-    "temp_component_temperature": {'type': 'number', 'friendly_name': 'Component Temperature', 'unit': '°C'},
+    "temp_air_temperature": {'type': 'number', 'friendly_name': 'Air Temperature', 'unit': '°C', 'min': -40, 'max': 120, 'max_rate': 1},
+    "temp_component_temperature": {'type': 'number', 'friendly_name': 'Component Temperature', 'unit': '°C', 'min': -40, 'max': 150, 'max_rate': 1},
 
     # Monitoring (data over the last 24 hours)
-    "monitoring_building_consumption": {'type': 'number', 'friendly_name': 'Monitoring Building Consumption', 'unit': 'Wh'},
+    "monitoring_building_consumption": {'type': 'number', 'friendly_name': 'Monitoring Building Consumption', 'unit': 'Wh', 'statistics': 'sum'},
     "monitoring_economy_factor": {'type': 'number', 'friendly_name': 'Monitoring Economy Factor', 'unit': ''},
-    "monitoring_grid_consumption": {'type': 'number', 'friendly_name': 'Monitoring Grid Consumption', 'unit': 'Wh'},
-    "monitoring_grid_injection": {'type': 'number', 'friendly_name': 'Monitoring Grid Injection', 'unit': 'Wh'},
+    "monitoring_grid_consumption": {'type': 'number', 'friendly_name': 'Monitoring Grid Consumption', 'unit': 'Wh', 'statistics': 'sum'},
+    "monitoring_grid_injection": {'type': 'number', 'friendly_name': 'Monitoring Grid Injection', 'unit': 'Wh', 'statistics': 'sum'},
     "monitoring_grid_power_flow": {'type': 'number', 'friendly_name': 'Monitoring Grid Power Flow', 'unit': 'Wh'},
     "monitoring_self_consumption": {'type': 'number', 'friendly_name': 'Monitoring Self Consumption', 'unit': '%'},
     "monitoring_self_sufficiency": {'type': 'number', 'friendly_name': 'Monitoring Self Suffiency', 'unit': '%'},
-    "monitoring_solar_production": {'type': 'number', 'friendly_name': 'Monitoring Solar Production', 'unit': 'Wh'},
+    "monitoring_solar_production": {'type': 'number', 'friendly_name': 'Monitoring Solar Production', 'unit': 'Wh', 'statistics': 'sum'},
 
     # Monitoring (instant minute data)
     "monitoring_minute_building_consumption": {'type': 'number', 'friendly_name': 'Monitoring Building Consumption (minute)', 'unit': 'W'},
@@ -108,15 +157,22 @@ GET_REQUESTS = {
 }
 
 # Services
+# 'input' is the setting sent to the inverter, fields are sent in order as a list if several
+# 'refresh' lists the GET_REQUESTS keys read back right after a successful change
+# Optional 'requires' : capability the inverter must have, other inverters answer 'unsupported' right away
 POST_REQUESTS = {
     "inverter_mode":    {"friendly_name": 'Inverter Mode',
                          "description": 'Change the mode of the inverter.',
+                         "input": 'inverter_mode',
+                         "refresh": ['manager_inverter_mode'],
                             "fields": {
                                 "mode": {"type": All(str, In(['smg', 'bup', 'ong', 'ofg'])), "example": 'smg'}
                                 }
                         },
     "mppt":             {"friendly_name": 'Maximum Power Point Tracking Range',
                          "description": 'Change the working range of the MPPT.',
+                         "input": 'mppt',
+                         "refresh": [],
                             "fields": {
                                 "low": {"type": All(int, Range(min=350)), "example": 350},
                                 "high": {"type": All(int, Range(max=700)), "example": 700}
@@ -124,51 +180,163 @@ POST_REQUESTS = {
                         },
     "feed_in":          {"friendly_name": 'Grid Feed-in (Injection)',
                          "description": 'Change whether or not the inverter injects power into the grid.',
+                         "input": 'feed_in',
+                         "refresh": [],
                             "fields": {
                                 "active": {"type": All(bool), "example": True},
                                 }
                         },
     "injection_power":  {"friendly_name": 'Injection Power Limit',
                          "description": 'Change the power limit when injecting into the grid.',
+                         "input": 'injection_power',
+                         "refresh": ['inverter_injection_power_limit'],
                             "fields": {
                                 "limit": {"type": All(int, Range(min=0,max=8000)), "example": 3000},
                                 }
                         },
     #"lcd_time":         {"friendly_name": 'LCD Screen Sleep Time',
     #                     "description": 'Change the time it takes for the LCD screen to go to sleep.',
+    #                     "input": 'lcd_time',
+    #                     "refresh": ['manager_lcd_sleep_time'],
     #                        "fields": {
     #                            "time": {"type": All(int, In([0, 1, 2, 10, 20])), "example": 0},
     #                            }
     #                    },
     "night_discharge":  {"friendly_name": 'Battery Night Discharge',
                          "description": 'Change whether or not the battery should discharge at night.',
+                         "input": 'night_discharge',
+                         "refresh": ['inverter_battery_night_discharge'],
                             "fields": {
                                 "active": {"type": All(bool), "example": False, "values": [True, False]},
                                 }
                         },
     "grid_charge":      {"friendly_name": 'Battery Charge From Grid',
                          "description": 'Change whether or not the battery should charge from the grid.',
+                         "input": 'grid_charge',
+                         "refresh": ['inverter_battery_grid_charge'],
                             "fields": {
                                 "active": {"type": All(bool), "example": False, "values": [True, False]},
                                 }
                         },
     "relay":            {"friendly_name": 'Relay State',
                          "description": 'Change the state of the relay.',
+                         "input": 'relay_active',
+                         "requires": 'relay',
+                         "refresh": ['manager_relay_state'],
                             "fields": {
                                 "active": {"type": All(bool), "example": False, "values": [True, False]},
                                 }
                         },
     "ac_output":        {"friendly_name": 'AC Output State',
                          "description": 'Change whether or not the AC output should be active.',
+                         "input": 'ac_output_active',
+                         "refresh": [],
                             "fields": {
                                 "active": {"type": All(bool), "example": True, "values": [True, False]},
                                 }
                         }
 }
 
+def key_category(key: str) -> str:
+    """Return the category a data key belongs to (longest matching prefix)."""
+    for category in sorted(GET_CATEGORIES, key=len, reverse=True):
+        if key.startswith(category + "_"): return category
+    return key
+
+KEY_CATEGORIES = {key: key_category(key) for key in GET_REQUESTS}
+
+# Capability required by each key, its own or its category's
+KEY_REQUIRES = {key: val.get('requires', GET_CATEGORIES[KEY_CATEGORIES[key]].get('requires'))
+                for key, val in GET_REQUESTS.items()}
+
+# Values derived from power readings by the coordinator, one pass per poll (see derived.py)
+DERIVED_WINDOWS = {"5m": 300, "15m": 900, "60m": 3600} # rolling means, seconds
+
+def derived_sensors() -> dict:
+    """Return the definition of every derived sensor, by key."""
+    sensors = {}
+    for key, info in GET_REQUESTS.items():
+        derive = info.get('derive')
+        if derive is None: continue
+        name = info['friendly_name']
+
+        sensors[key + "_energy"] = {'source': key, 'kind': 'energy', 'friendly_name': name + ' Energy',
+                                    'unit': 'Wh', 'state_class': 'total_increasing'}
+        if derive == 'signed':
+            sensors[key + "_energy_reverse"] = {'source': key, 'kind': 'energy_reverse', 'friendly_name': name + ' Energy (Reverse)',
+                                                'unit': 'Wh', 'state_class': 'total_increasing'}
+        for window in DERIVED_WINDOWS:
+            sensors[key + "_mean_" + window] = {'source': key, 'kind': 'mean', 'window': window, 'friendly_name': f"{name} Mean ({window})",
+                                                'unit': info['unit'], 'state_class': 'measurement'}
+        sensors[key + "_min_today"] = {'source': key, 'kind': 'min', 'friendly_name': name + ' Min Today',
+                                       'unit': info['unit'], 'state_class': 'measurement'}
+        sensors[key + "_max_today"] = {'source': key, 'kind': 'max', 'friendly_name': name + ' Max Today',
+                                       'unit': info['unit'], 'state_class': 'measurement'}
+    return sensors
+
+DERIVED_SENSORS = derived_sensors()
+DERIVED_CATEGORIES = {KEY_CATEGORIES[val['source']] for val in DERIVED_SENSORS.values()}
+KEY_REQUIRES.update({key: KEY_REQUIRES[val['source']] for key, val in DERIVED_SENSORS.items()})
+
+# Fleet aggregate (see fleet.py) : totals and extremes across inverters, capacity-weighted SOC
+FLEET_SUMS = ["pv_power_total", "battery_power", "output_power_total",
+              *[key for key in GET_REQUESTS if KEY_CATEGORIES[key] == "monitoring" and GET_REQUESTS[key]['unit'] == 'Wh']]
+FLEET_EXTREMES = ["pv_power_total", "battery_power", "output_power_total", "battery_soc"]
+
+def fleet_sensors() -> dict:
+    """Return the definition of every fleet aggregate sensor, by key."""
+    sensors = {}
+    for key in FLEET_SUMS:
+        info = GET_REQUESTS[key]
+        sensors["fleet_" + key] = {'source': key, 'kind': 'sum', 'friendly_name': 'Fleet ' + info['friendly_name'],
+                                   'unit': info['unit']}
+    sensors["fleet_battery_soc"] = {'source': 'battery_soc', 'kind': 'soc', 'friendly_name': 'Fleet Battery SOC', 'unit': '%'}
+    for key in FLEET_EXTREMES:
+        info = GET_REQUESTS[key]
+        for kind in ('min', 'max'):
+            sensors[f"fleet_{key}_{kind}"] = {'source': key, 'kind': kind, 'unit': info['unit'],
+                                              'friendly_name': f"Fleet {info['friendly_name']} {kind.capitalize()}"}
+    return sensors
+
+FLEET_SENSORS = fleet_sensors()
+
+# Data snapshot slots, every key has a fixed index computed once
+# NOTE extra keys hold whole payloads (timeline, smartload) or only signal updates (diagnostics)
+SLOTS = {key: slot for slot, key in enumerate([*GET_REQUESTS, *DERIVED_SENSORS, "timeline", "smartload", "diagnostics"])}
+
+# (category, field) -> slot, so raw API payloads are stored without building keys
+CATEGORY_SLOTS = {category: {} for category in GET_CATEGORIES}
+for key, category in KEY_CATEGORIES.items():
+    CATEGORY_SLOTS[category][key[len(category) + 1:]] = SLOTS[key]
+
+# Validation of new readings, one pass per poll over the keys that have bounds
+# (slot, key, scale, min, max, max_rate) by slot
+VALIDATION = {SLOTS[key]: (SLOTS[key], key, val.get('scale', 1.), val.get('min', -inf), val.get('max', inf), val.get('max_rate'))
+              for key, val in GET_REQUESTS.items() if {'min', 'max', 'max_rate'} & val.keys()}
+
+# Validated slots of each category, their last accepted reading is refreshed on every fetch even when unchanged
+CATEGORY_VALIDATION = {category: [slot for slot in slots.values() if slot in VALIDATION]
+                       for category, slots in CATEGORY_SLOTS.items()}
+
+# Write heartbeat of keys (seconds), their entities write the value again once it is due even if unchanged
+HEARTBEATS = {key: val['heartbeat'] for key, val in GET_REQUESTS.items() if 'heartbeat' in val}
+
 LIST_TEXT  = list_keys(GET_REQUESTS, 'text')
 LIST_FLOAT = list_keys(GET_REQUESTS, 'number')
 
+# Diagnostic entities (performance of each HUB)
+DIAGNOSTIC_SENSORS = {
+    "login_time": {'friendly_name': 'Login Time', 'unit': 'ms', 'state_class': 'measurement'},
+    "fetch_time": {'friendly_name': 'Fetch Time', 'unit': 'ms', 'state_class': 'measurement'},
+    "store_time": {'friendly_name': 'Store Time', 'unit': 'ms', 'state_class': 'measurement'},
+    "polls_success": {'friendly_name': 'Successful Polls', 'unit': '', 'state_class': 'total_increasing'},
+    "polls_timeout": {'friendly_name': 'Timed Out Polls', 'unit': '', 'state_class': 'total_increasing'},
+    "polls_error": {'friendly_name': 'Failed Polls', 'unit': '', 'state_class': 'total_increasing'},
+    "rejected_values": {'friendly_name': 'Rejected Values', 'unit': '', 'state_class': 'total_increasing'},
+    "bytes_received": {'friendly_name': 'Bytes Received', 'unit': 'B', 'state_class': 'total_increasing'},
+    "last_good_poll_age": {'friendly_name': 'Last Good Poll Age', 'unit': 's', 'state_class': 'measurement'},
+}
+
 # Icons for Logbook entries
 TIMELINE_WARNINGS = {
     'com_lost': 'mdi:lan-disconnect',
@@ -200,4 +368,60 @@ TIMELINE_WARNINGS = {
     'good_1': 'mdi:check-circle',
     'good_2': 'mdi:check-circle',
     'good_3': 'mdi:check-circle',
-}
\ No newline at end of file
+}
+
+# Value decoders
+def number_decoder(scale: float = 1., ndigits: int = 2) -> Callable[[Any], float | None]:
+    """Build a decoder turning raw API values into scaled and rounded floats."""
+    def decode(raw):
+        if raw is None: return None
+        return round(float(raw)*scale, ndigits)
+    return decode
+
+def text_decoder(enum: dict | None = None, icon: str = 'mdi:alphabetical') -> Callable[[Any], tuple]:
+    """Build a decoder turning raw API values into (text, icon), mapped through enum if any."""
+    if enum is None:
+        return lambda raw: (str(raw), icon)
+    return lambda raw: (enum.get(str(raw), str(raw)), icon)
+
+def timeline_decoder(icons: dict, icon: str = 'mdi:alphabetical') -> Callable[[Any], tuple]:
+    """Build a decoder turning the raw timeline into (latest message, matching icon)."""
+    def decode(raw):
+        event = raw[0]
+        return event["message"], icons.get(event["type"], icon)
+    return decode
+
+def build_decoder(info: dict) -> Callable:
+    """Build the decoder matching a GET_REQUESTS entry."""
+    if info["type"] == 'number':
+        return number_decoder(info.get('scale', 1.), info.get('round', 2))
+    return text_decoder(info.get('enum'))
+
+# Write filters
+def changed(last, value, age: float) -> bool:
+    """Default filter : write any change."""
+    return value != last
+
+def deadband_filter(absolute: float = 0., relative: float = 0.,
+                    heartbeat: float | None = None) -> Callable[[Any, Any, float], bool]:
+    """Build a filter telling whether a value is worth writing, given the last written one and its age."""
+    def significant(last, value, age):
+        if heartbeat is not None and age >= heartbeat: return True # Even unchanged
+        if value == last: return False
+        if last is None or value is None: return True
+        return abs(value - last) > max(absolute, relative*abs(last))
+    return significant
+
+def build_filter(info: dict) -> Callable:
+    """Build the write filter matching a GET_REQUESTS entry."""
+    if 'deadband_abs' not in info and 'deadband_rel' not in info:
+        return changed
+    return deadband_filter(info.get('deadband_abs', 0.), info.get('deadband_rel', 0.), info.get('heartbeat'))
+
+# Compiled once, entities only do a lookup in these tables
+FILTERS = {key: build_filter(val) for key, val in GET_REQUESTS.items()}
+DECODERS = {key: build_decoder(val) for key, val in GET_REQUESTS.items()}
+DECODERS.update({key: number_decoder() for key in DERIVED_SENSORS})
+DECODERS.update({key: number_decoder() for key in FLEET_SENSORS})
+DECODERS["timeline"] = timeline_decoder(TIMELINE_WARNINGS)
+DECODERS["diagnostics"] = number_decoder()
@@ -0,0 +1,115 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+'''
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import logging
+import random
+import time
+from typing import Any, Dict
+import zlib
+
+from homeassistant.core import HomeAssistant, callback # type: ignore
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+# FLEET SCHEDULER #
+class FleetScheduler():
+    """
+    Domain-level scheduler spreading the polls of every HUB.
+
+    Each inverter gets a deterministic phase within the polling interval
+    (derived from its ID, so it doesn't move when inverters are added)
+    plus some random jitter, and at most `max_in_flight` polls may run at
+    the same time. Timings of the last cycles are kept so one can check
+    that the load stays spread out as the fleet grows.
+    """
+
+    def __init__(self, max_in_flight: int = FLEET_MAX_IN_FLIGHT,
+                 jitter: float = FLEET_JITTER) -> None:
+        self.max_in_flight = max_in_flight
+        self.jitter = jitter
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._in_flight = 0
+        self._cycles: deque = deque(maxlen=FLEET_HISTORY)
+        return None
+
+    @staticmethod
+    @callback
+    def get(hass: HomeAssistant, **config) -> FleetScheduler:
+        """Return the scheduler of this Home Assistant instance, create it if needed."""
+        if SCHEDULER_KEY not in hass.data:
+            hass.data[SCHEDULER_KEY] = FleetScheduler(**config)
+        return hass.data[SCHEDULER_KEY]
+
+    @staticmethod
+    def phase(uuid: str, interval: float) -> float:
+        """Return the deterministic offset (in seconds) of an inverter within the interval."""
+        return (zlib.crc32(str(uuid).encode()) % 1000) / 1000 * interval
+
+    def next_delay(self, uuid: str, interval: float) -> float:
+        """Return the delay until the next phase point of an inverter, with jitter."""
+        delay = (self.phase(uuid, interval) - time.time()) % interval
+        if delay < interval / 2: delay += interval # Never poll twice in a row too quickly
+        return delay + random.uniform(0, self.jitter)
+
+    @asynccontextmanager
+    async def slot(self, name: str, interval: float):
+        """Wait for a free polling slot, and record the timing of the poll."""
+        requested = time.time()
+        async with self._semaphore:
+            started = time.time()
+            self._in_flight += 1
+            in_flight = self._in_flight
+            try:
+                yield
+            finally:
+                self._in_flight -= 1
+                self._record(name, interval, requested, started, time.time(), in_flight)
+
+    def _record(self, name: str, interval: float, requested: float,
+                started: float, ended: float, in_flight: int) -> None:
+        """Add a poll to the timing of its cycle."""
+        cycle_start = requested - requested % interval
+        cycle = next((c for c in reversed(self._cycles) if c["start"] == cycle_start), None)
+        if cycle is None:
+            cycle = {"start": cycle_start, "polls": [], "peak_in_flight": 0}
+            self._cycles.append(cycle)
+
+        cycle["peak_in_flight"] = max(cycle["peak_in_flight"], in_flight)
+        cycle["polls"].append({
+            "hub": name,
+            "offset": round(started - cycle_start, 3),
+            "wait": round(started - requested, 3),
+            "duration": round(ended - started, 3),
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the timing of the last cycles, as a JSON serializable object."""
+        cycles = []
+        for cycle in self._cycles:
+            polls = cycle["polls"]
+            offsets = [p["offset"] for p in polls]
+            cycles.append({
+                "start": cycle["start"],
+                "polls": polls,
+                "peak_in_flight": cycle["peak_in_flight"],
+                "spread": round(max(offsets) - min(offsets), 3) if offsets else 0,
+                "total_wait": round(sum(p["wait"] for p in polls), 3),
+                "total_duration": round(sum(p["duration"] for p in polls), 3),
+            })
+        return {
+            "max_in_flight": self.max_in_flight,
+            "jitter": self.jitter,
+            "cycles": cycles,
+        }
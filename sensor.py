@@ -8,15 +8,18 @@ July 2024
 
 import logging
 
-from homeassistant.components.sensor import SensorEntity               # type: ignore
+from homeassistant.components.sensor import SensorEntity, SensorDeviceClass # type: ignore
 from homeassistant.helpers.update_coordinator import CoordinatorEntity # type: ignore
 from homeassistant.core import HomeAssistant, callback                 # type: ignore
 from homeassistant.config_entries import ConfigEntry                   # type: ignore
 from homeassistant.helpers.entity_platform import AddEntitiesCallback  # type: ignore
+from homeassistant.helpers.entity import EntityCategory                # type: ignore
 
-from .const import DOMAIN
-from .path import LIST_FLOAT, GET_REQUESTS
+from .const import DOMAIN, DIAGNOSTICS_KEY, FLEET_TYPE
+from .path import LIST_FLOAT, GET_REQUESTS, DERIVED_SENSORS, FLEET_SENSORS, KEY_REQUIRES, DECODERS, FILTERS, DIAGNOSTIC_SENSORS, SLOTS, HEARTBEATS, changed
 from .inverter import InverterCoordinator
+from .breaker import CLOSED, OPEN, HALF_OPEN
+from .fleet import FleetAggregate
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -25,17 +28,48 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry,
                             async_add_entities: AddEntitiesCallback) -> None:
     """Create each sensor for a given config entry."""
 
+    # Fleet aggregates only have their own totals
+    if entry.data.get("type") == FLEET_TYPE:
+        fleet = FleetAggregate.get_all(hass)[entry.entry_id]
+        async_add_entities([FleetSensor(fleet, key, entry, val["friendly_name"], val["unit"])
+                            for key, val in FLEET_SENSORS.items()], True)
+        return None
+
     # Get Inverter from UUID
     IC: InverterCoordinator = hass.data[DOMAIN][entry.entry_id]
-    entities = []
 
-    # Init "sensor" entities
-    for key in LIST_FLOAT:
-        val = GET_REQUESTS[key]
-        e = InverterSensor(IC, key, entry, val["friendly_name"], val["unit"])
-        entities.append(e)
+    @callback
+    def add_entities(with_requirement: bool) -> None:
+        """Create the entities with (or without) a capability requirement that this model meets."""
+        entities = []
+
+        # Init "sensor" entities
+        for key in LIST_FLOAT:
+            if (KEY_REQUIRES[key] is not None) != with_requirement: continue
+            if not IC.supports(KEY_REQUIRES[key]): continue # Not on this model
+            val = GET_REQUESTS[key]
+            e = InverterSensor(IC, key, entry, val["friendly_name"], val["unit"])
+            entities.append(e)
+
+        # Init derived entities (energy, rolling means, daily extremes)
+        for key, val in DERIVED_SENSORS.items():
+            if (KEY_REQUIRES[key] is not None) != with_requirement: continue
+            if not IC.supports(KEY_REQUIRES[key]): continue # Not on this model
+            e = InverterDerivedSensor(IC, key, entry, val["friendly_name"], val["unit"], val["state_class"])
+            entities.append(e)
 
-    async_add_entities(entities, True)
+        # Init diagnostic entities
+        if not with_requirement:
+            for key, val in DIAGNOSTIC_SENSORS.items():
+                e = InverterDiagnosticSensor(IC, key, entry, val["friendly_name"], val["unit"], val["state_class"])
+                entities.append(e)
+            entities.append(InverterBreakerSensor(IC, entry))
+
+        async_add_entities(entities, True)
+
+    # Entities depending on a capability wait for the probe, if still running
+    add_entities(with_requirement=False)
+    entry.async_on_unload(IC.async_when_probed(lambda: add_entities(with_requirement=True)))
 
 class InverterSensor(CoordinatorEntity, SensorEntity):
     """A sensor that returns numerical values with units."""
@@ -44,6 +78,12 @@ class InverterSensor(CoordinatorEntity, SensorEntity):
         """Pass coordinator to CoordinatorEntity."""
         super().__init__(coordinator)
         self.data_key = data_key
+        self._decode = DECODERS[data_key]
+        self._slot = SLOTS[data_key]
+        self._significant = FILTERS.get(data_key, changed)
+        self._heartbeat = HEARTBEATS.get(data_key) # seconds, None if only changes are written
+        self._last_write = 0. # monotonic time of the last state written
+        self._stale = None    # stale flag of the last state written
         self._entry_id = entry.entry_id
         self._namespace = DOMAIN + "." + data_key
         self._device = entry.title
@@ -74,29 +114,162 @@ class InverterSensor(CoordinatorEntity, SensorEntity):
         }
 
     @property
-    def native_value(self):
-        """Return the native value of the sensor entity."""
-
-        # Skip all steps if None
-        if self._attr_native_value == None: return None
-        
-        # Treat special cases that need to be converted to proper % format
-        if self.data_key in ("qu1", "qu2", "qu3", "qu4"): 
-            return self._attr_native_value*100. # 0..1 -> %
+    def extra_state_attributes(self):
+        """Flag values loaded from the last snapshot until the inverter answers."""
+        if self.coordinator.stale:
+            return {"stale": True, "data_time": self.coordinator.data_time}
+        return None
 
-        # Return raw data for the rest
-        return round(self._attr_native_value, 2)
+    async def async_added_to_hass(self) -> None:
+        """Subscribe to this entity's own data key rather than to every update."""
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            self.coordinator.async_add_key_listener(self.data_key, self._handle_coordinator_update)
+        )
+        if self._heartbeat is not None:
+            self.async_on_remove(lambda: self.coordinator.async_heartbeat_at(self._slot, None))
+        self._handle_coordinator_update() # Catch up with data fetched before subscribing
 
     @callback
     def _handle_coordinator_update(self) -> None:
         """Handle updated data from the coordinator."""
         try:
-            fetched = float(self.coordinator.data.get(self.data_key, None))
-            if self._attr_native_value == fetched: return None 
-            self._attr_native_value = fetched
+            fetched = self._decode(self.coordinator.data[self._slot])
         except Exception as e:
-            self._attr_native_value = None # N/A
+            fetched = None # N/A
+
+        # Skip changes within the deadband until a heartbeat is due, unless the stale flag changed
+        now = self.coordinator.clock()
+        stale = self.coordinator.stale
+        if stale == self._stale and not self._significant(self._attr_native_value, fetched, now - self._last_write):
+            return None
+        # A steady value is only recorded again on a heartbeat if forced
+        self._attr_force_update = fetched == self._attr_native_value and stale == self._stale
+        self._attr_native_value = fetched
+        self._last_write = now
+        self._stale = stale
         
+        # Request a data update
+        self.async_write_ha_state()
+        self._attr_force_update = False
+        if self._heartbeat is not None: self.coordinator.async_heartbeat_at(self._slot, now + self._heartbeat)
+        return None
+
+class InverterDerivedSensor(InverterSensor):
+    """A sensor that returns a value computed by the coordinator from power readings."""
+
+    def __init__(self, coordinator, data_key, entry, friendly_name, unit, state_class):
+        """Pass coordinator to CoordinatorEntity."""
+        super().__init__(coordinator, data_key, entry, friendly_name, unit)
+        self._attr_state_class = state_class
+        self._attr_icon = "mdi:lightning-bolt" if unit == "Wh" else "mdi:chart-bell-curve-cumulative"
+        if unit == "Wh": self._attr_device_class = SensorDeviceClass.ENERGY
+
+class InverterDiagnosticSensor(InverterSensor):
+    """A sensor that returns performance statistics of its HUB."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False # Written after every poll, only enabled on demand
+
+    def __init__(self, coordinator, stat, entry, friendly_name, unit, state_class=None):
+        """Bind to the diagnostics key, updated after every poll."""
+        super().__init__(coordinator, DIAGNOSTICS_KEY, entry, friendly_name, unit)
+        self.stat = stat
+        self._attr_state_class = state_class
+        self._attr_icon = "mdi:speedometer"
+        self._attr_unique_id = f"{self._entry_id}_{self.stat}"
+
+    @property
+    def extra_state_attributes(self):
+        return None
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Handle updated statistics from the coordinator."""
+        fetched = self._decode(self.coordinator.stats.value(self.stat))
+        if self._attr_native_value == fetched: return None
+        self._attr_native_value = fetched
+
+        # Request a data update
+        self.async_write_ha_state()
+        return None
+
+class InverterBreakerSensor(InverterDiagnosticSensor):
+    """A sensor that returns the state of its HUB's circuit breaker."""
+
+    ICONS = {CLOSED: "mdi:lan-connect", OPEN: "mdi:lan-disconnect", HALF_OPEN: "mdi:lan-pending"}
+
+    _attr_device_class = SensorDeviceClass.ENUM
+    _attr_options = [CLOSED, OPEN, HALF_OPEN]
+    _attr_entity_registry_enabled_default = True # Only written when the state changes
+
+    def __init__(self, coordinator, entry):
+        """Bind to the diagnostics key, updated after every poll."""
+        super().__init__(coordinator, "breaker_state", entry, "Connection State", None)
+        self._attr_native_unit_of_measurement = None
+
+    @property
+    def extra_state_attributes(self):
+        breaker = self.coordinator.breaker.as_dict()
+        return {"failures": breaker["failures"], "trips": breaker["trips"]}
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Handle a new breaker state from the coordinator."""
+        fetched = self.coordinator.breaker.state
+        if self._attr_native_value == fetched: return None
+        self._attr_native_value = fetched
+        self._attr_icon = self.ICONS[fetched]
+
+        # Request a data update
+        self.async_write_ha_state()
+        return None
+
+class FleetSensor(SensorEntity):
+    """A sensor that returns a total or an extreme across several inverters."""
+
+    _attr_should_poll = False
+
+    def __init__(self, fleet, data_key, entry, friendly_name, unit):
+        """Bind to a fleet aggregate key."""
+        self.fleet = fleet
+        self.data_key = data_key
+        self._decode = DECODERS[data_key]
+        self._entry_id = entry.entry_id
+        self._device = entry.title
+
+        self._attr_name = friendly_name
+        self._attr_native_value = None
+        self._attr_native_unit_of_measurement = str(unit)
+        self._attr_icon = "mdi:arrow-expand-vertical" if data_key.endswith(("_min", "_max")) else "mdi:sigma"
+        self._attr_unique_id = f"{self._entry_id}_{self.data_key}"
+
+        self._attr_has_entity_name = True
+
+    @property
+    def device_info(self):
+        """Return device information about this entity."""
+        return {
+            "identifiers": {(DOMAIN, self._entry_id)},
+            "name": self._device,
+            "manufacturer": "Imeon Energy",
+            "model": "Fleet Aggregate",
+            "sw_version": "1.0",
+        }
+
+    async def async_added_to_hass(self) -> None:
+        """Subscribe to this entity's own fleet key."""
+        await super().async_added_to_hass()
+        self.async_on_remove(self.fleet.async_add_key_listener(self.data_key, self._handle_fleet_update))
+        self._handle_fleet_update()
+
+    @callback
+    def _handle_fleet_update(self) -> None:
+        """Handle updated totals from the fleet aggregate."""
+        fetched = self._decode(self.fleet.values[self.data_key])
+        if self._attr_native_value == fetched: return None
+        self._attr_native_value = fetched
+
         # Request a data update
         self.async_write_ha_state()
         return None
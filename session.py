@@ -0,0 +1,111 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+'''
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Dict
+
+import aiohttp
+from imeon_inverter_api.inverter import Inverter                   # type: ignore
+from homeassistant.core import HomeAssistant, Event, callback      # type: ignore
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE          # type: ignore
+from homeassistant.helpers.storage import Store                    # type: ignore
+
+from .const import *
+from .stats import HubStats
+
+_LOGGER = logging.getLogger(__name__)
+
+async def raise_for_missing(response: aiohttp.ClientResponse) -> None:
+    """Fail requests to endpoints the inverter doesn't have with their status, not a decoding error."""
+    if response.status == 404: response.raise_for_status()
+
+
+# SESSION POOL #
+class SessionPool():
+    """
+    Keep-alive HTTP connection pool shared by every inverter.
+
+    There is one pool per Home Assistant instance. Each inverter still
+    gets its own lightweight session (cookies are not scoped by address
+    by the API, so jars can't be shared) but all sessions borrow their
+    connections from the same connector. Login cookies are persisted so
+    a restart can reuse them instead of logging in again.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self.hass = hass
+        self._connector = aiohttp.TCPConnector(limit=POOL_SIZE, keepalive_timeout=POOL_KEEPALIVE)
+        self._store = Store(hass, SESSION_STORE_VERSION, SESSION_STORE_KEY)
+        self._saved: Dict[str, Any] | None = None # entry_id -> {"address", "cookies", "time"}
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, self.async_close)
+        return None
+
+    @staticmethod
+    @callback
+    def get(hass: HomeAssistant) -> SessionPool:
+        """Return the pool of this Home Assistant instance, create it if needed."""
+        if POOL_KEY not in hass.data:
+            hass.data[POOL_KEY] = SessionPool(hass)
+        return hass.data[POOL_KEY]
+
+    @callback
+    def attach(self, api: Inverter, stats: HubStats | None = None) -> None:
+        """Give an API object its own session on top of the shared connector."""
+        trace_configs = []
+        if stats is not None:
+            # Count bytes received for diagnostics
+            async def on_chunk(session, context, params) -> None:
+                stats.bytes_received += len(params.chunk)
+            trace = aiohttp.TraceConfig()
+            trace.on_response_chunk_received.append(on_chunk)
+            trace_configs.append(trace)
+
+        api._client._Client__session = aiohttp.ClientSession(connector=self._connector,
+                                                             connector_owner=False,
+                                                             raise_for_status=raise_for_missing,
+                                                             trace_configs=trace_configs)
+
+    async def async_restore(self, api: Inverter, uuid: str) -> float | None:
+        """Reuse saved login cookies for this inverter if still valid, return their login time."""
+        if self._saved is None:
+            self._saved = await self._store.async_load() or {}
+
+        saved = self._saved.get(str(uuid))
+        if saved is None or saved.get("address") != api.get_address() \
+                or time.time() - saved.get("time", 0) > SESSION_LIFETIME:
+            return None
+
+        session = await api._client.get_session()
+        session.cookie_jar.update_cookies(saved.get("cookies", {}))
+        api._Inverter__auth_valid = True
+        return saved["time"]
+
+    @callback
+    def save(self, api: Inverter, uuid: str) -> None:
+        """Remember the login cookies of an inverter (written to disk lazily)."""
+        if self._saved is None: self._saved = {}
+        self._saved[str(uuid)] = {
+            "address": api.get_address(),
+            "cookies": api._client.get_session_cookies(),
+            "time": time.time(),
+        }
+        self._store.async_delay_save(lambda: self._saved, SESSION_SAVE_DELAY)
+
+    @callback
+    def forget(self, uuid: str) -> None:
+        """Drop the saved login cookies of an inverter."""
+        if self._saved and self._saved.pop(str(uuid), None) is not None:
+            self._store.async_delay_save(lambda: self._saved, SESSION_SAVE_DELAY)
+
+    async def async_close(self, event: Event | None = None) -> None:
+        """Close every pooled connection."""
+        await self._connector.close()
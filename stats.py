@@ -0,0 +1,129 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+'''
+
+from __future__ import annotations
+
+from collections import deque
+from contextlib import contextmanager
+import time
+from typing import Any, Dict
+
+from .const import *
+
+# ROLLING HISTOGRAM #
+class RollingHistogram():
+    """Durations over a rolling window, summarised as buckets and percentiles."""
+
+    BUCKETS = (0.1, 0.25, 0.5, 1., 2.5, 5., 10., 20., 40.) # seconds
+
+    def __init__(self, size: int = STATS_WINDOW) -> None:
+        self._values: deque = deque(maxlen=size)
+        return None
+
+    def add(self, value: float) -> None:
+        self._values.append(value)
+
+    @property
+    def last(self) -> float | None:
+        return self._values[-1] if self._values else None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the histogram as a JSON serializable object."""
+        values = sorted(self._values)
+        if not values: return {"count": 0}
+
+        buckets = {f"<={b}s": 0 for b in self.BUCKETS}
+        buckets["+inf"] = 0
+        for value in values:
+            bucket = next((f"<={b}s" for b in self.BUCKETS if value <= b), "+inf")
+            buckets[bucket] += 1
+
+        return {
+            "count": len(values),
+            "last": round(self._values[-1], 4),
+            "mean": round(sum(values) / len(values), 4),
+            "p50": round(values[len(values) // 2], 4),
+            "p90": round(values[min(len(values) - 1, int(len(values) * .9))], 4),
+            "max": round(values[-1], 4),
+            "buckets": buckets,
+        }
+
+
+# HUB STATISTICS #
+class HubStats():
+    """
+    Performance counters of a single HUB.
+
+    Keeps timings of the login, fetch and store steps of each poll
+    as rolling histograms, poll outcome counters, bytes received,
+    the time of the last successful poll and the readings rejected
+    by validation (count and last rejected reading of each key).
+    """
+
+    def __init__(self) -> None:
+        self.login = RollingHistogram()
+        self.fetch = RollingHistogram()
+        self.store = RollingHistogram()
+        self.success = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self.last_success: float | None = None # timestamp
+        self.rejections: Dict[str, int] = {}   # key -> readings rejected
+        self.last_rejected: Dict[str, Dict[str, Any]] = {} # key -> {"value", "reason", "time"}
+        return None
+
+    @contextmanager
+    def timer(self, histogram: RollingHistogram):
+        """Time a block of code into the given histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.add(time.perf_counter() - start)
+
+    def poll_succeeded(self) -> None:
+        self.success += 1
+        self.last_success = time.time()
+
+    def rejected(self, key: str, value: float, reason: str) -> None:
+        self.rejections[key] = self.rejections.get(key, 0) + 1
+        self.last_rejected[key] = {"value": value, "reason": reason, "time": time.time()}
+
+    @property
+    def last_good_poll_age(self) -> float | None:
+        return None if self.last_success is None else time.time() - self.last_success
+
+    def value(self, name: str) -> float | None:
+        """Return the current value of a diagnostic entity (see DIAGNOSTIC_SENSORS)."""
+        match name:
+            case "login_time" | "fetch_time" | "store_time":
+                last = getattr(self, name[:-5]).last
+                return None if last is None else last * 1000 # ms
+            case "polls_success": return self.success
+            case "polls_timeout": return self.timeouts
+            case "polls_error": return self.errors
+            case "bytes_received": return self.bytes_received
+            case "last_good_poll_age": return self.last_good_poll_age
+            case "rejected_values": return sum(self.rejections.values())
+        return None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return every statistic as a JSON serializable object."""
+        return {
+            "login": self.login.as_dict(),
+            "fetch": self.fetch.as_dict(),
+            "store": self.store.as_dict(),
+            "polls_success": self.success,
+            "polls_timeout": self.timeouts,
+            "polls_error": self.errors,
+            "bytes_received": self.bytes_received,
+            "last_good_poll_age": self.last_good_poll_age,
+            "rejections": self.rejections,
+            "last_rejected": self.last_rejected,
+        }
@@ -15,7 +15,7 @@ from homeassistant.config_entries import ConfigEntry                   # type: i
 from homeassistant.helpers.entity_platform import AddEntitiesCallback  # type: ignore
 
 from .const import DOMAIN
-from .path import LIST_TEXT, GET_REQUESTS, TIMELINE_WARNINGS
+from .path import LIST_TEXT, GET_REQUESTS, KEY_REQUIRES, DECODERS, SLOTS
 from .inverter import InverterCoordinator
 
 _LOGGER = logging.getLogger(__name__)
@@ -27,19 +27,30 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry,
 
     # Get Inverter from UUID
     IC: InverterCoordinator = hass.data[DOMAIN][entry.entry_id]
-    entities = []
 
-    # Init text entities
-    for key in LIST_TEXT:
-        val = GET_REQUESTS[key]
-        e = InverterText(IC, key, entry, val["friendly_name"])
-        entities.append(e)
+    @callback
+    def add_entities(with_requirement: bool) -> None:
+        """Create the entities with (or without) a capability requirement that this model meets."""
+        entities = []
+
+        # Init text entities
+        for key in LIST_TEXT:
+            if (KEY_REQUIRES[key] is not None) != with_requirement: continue
+            if not IC.supports(KEY_REQUIRES[key]): continue # Not on this model
+            val = GET_REQUESTS[key]
+            e = InverterText(IC, key, entry, val["friendly_name"])
+            entities.append(e)
+
+        # Init timeline entity separately
+        if not with_requirement:
+            e = InverterText(IC, "timeline", entry, "Timeline")
+            entities.append(e)
 
-    # Init timeline entity separately
-    e = InverterText(IC, "timeline", entry, "Timeline")
-    entities.append(e)
+        async_add_entities(entities, True)
 
-    async_add_entities(entities, True)
+    # Entities depending on a capability wait for the probe, if still running
+    add_entities(with_requirement=False)
+    entry.async_on_unload(IC.async_when_probed(lambda: add_entities(with_requirement=True)))
 
 class InverterText(CoordinatorEntity, TextEntity):
     """A sensor that returns text values."""
@@ -48,6 +59,9 @@ class InverterText(CoordinatorEntity, TextEntity):
         """Pass coordinator to CoordinatorEntity."""
         super().__init__(coordinator)
         self.data_key = data_key
+        self._decode = DECODERS[data_key]
+        self._slot = SLOTS[data_key]
+        self._stale = None # stale flag of the last state written
         self._entry_id = entry.entry_id
         self._namespace = DOMAIN + "." + data_key
         self._device = entry.title
@@ -76,42 +90,32 @@ class InverterText(CoordinatorEntity, TextEntity):
         }
 
     @property
-    def native_value(self):
-        """Return the native value of the text entity."""
-
-        # Treat special cases that need formatting to be readable
-        if self.data_key == "mode_name":
-            match self._attr_native_value:
-                case "SMG" : return "Smart Grid"
-                case "BUP" : return "Backup"
-                case "100" : return "On Grid"
-                case "150" : return "Off Grid"
-        
-        # Send raw data for the rest
-        return self._attr_native_value
+    def extra_state_attributes(self):
+        """Flag values loaded from the last snapshot until the inverter answers."""
+        if self.coordinator.stale:
+            return {"stale": True, "data_time": self.coordinator.data_time}
+        return None
+
+    async def async_added_to_hass(self) -> None:
+        """Subscribe to this entity's own data key rather than to every update."""
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            self.coordinator.async_add_key_listener(self.data_key, self._handle_coordinator_update)
+        )
+        self._handle_coordinator_update() # Catch up with data fetched before subscribing
 
     @callback
     def _handle_coordinator_update(self) -> None:
         """Handle updated data from the coordinator."""
         try:
-            # Timeline requires special handling
-            if self.data_key == "timeline":
-                fetched = self.coordinator.data.get("timeline", None)[0]
-
-                if self._attr_native_value == fetched["message"]: return None 
-                self._attr_native_value = fetched["message"]
-                
-                # Attempt to change icons to match the event type
-                try: self._attr_icon = TIMELINE_WARNINGS[fetched["type"]]
-                except: pass
-
-            # Rest of the data is passed as is
-            else: 
-                fetched = str(self.coordinator.data.get(self.data_key, None))
-                if self._attr_native_value == fetched: return None 
-                self._attr_native_value = fetched
+            # Text decoders give back both the value and the matching icon
+            fetched, icon = self._decode(self.coordinator.data[self._slot])
         except Exception as e:
-            self._attr_native_value = None # N/A
+            fetched, icon = None, self._attr_icon # N/A
+        stale = self.coordinator.stale
+        if self._attr_native_value == fetched and self._attr_icon == icon and self._stale == stale: return None
+        self._attr_native_value, self._attr_icon = fetched, icon
+        self._stale = stale # Also shown as an attribute
 
         # Request a data update
         self.async_write_ha_state()
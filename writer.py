@@ -0,0 +1,110 @@
+'''
+Home Assistant integration for Imeon Inverters
+---
+Rodrigue Lemaire
+---
+July 2024
+'''
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Coroutine, Dict
+
+from imeon_inverter_api.inverter import Inverter # type: ignore
+from homeassistant.core import HomeAssistant, callback # type: ignore
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+# WRITE QUEUE #
+class WriteQueue():
+    """
+    Per-inverter queue merging setting changes into as few requests as possible.
+
+    Changes arriving less than WRITE_DEBOUNCE seconds apart are merged,
+    the last value winning for each setting, then sent in a single POST
+    (at most WRITE_MAX_DELAY seconds after the first one). Every caller
+    receives the result of that combined request. Once sent, the data
+    keys affected by the changes are handed over to `on_written` in a
+    single call so they can be read back.
+
+    Requests and read-backs run through `create_task`, so the owner can
+    track them and cancel them when the inverter is unloaded.
+    """
+
+    def __init__(self, hass: HomeAssistant, get_api: Callable[[], Inverter],
+                 on_written: Callable[[set], Awaitable] | None = None,
+                 create_task: Callable[[Coroutine], Any] | None = None) -> None:
+        self.hass = hass
+        self._get_api = get_api                  # API object may be replaced on reconfiguration
+        self._on_written = on_written
+        self._create_task = create_task or hass.async_create_task
+        self._pending: Dict[str, Any] = {}       # setting -> value
+        self._refresh: set = set()               # data keys to read back
+        self._waiters: list = []                 # futures of every merged caller
+        self._first: float | None = None         # time of the oldest pending change
+        self._timer: asyncio.TimerHandle | None = None
+        self._lock = asyncio.Lock()              # one request at a time
+        return None
+
+    async def async_set(self, inputs: Dict[str, Any], refresh: tuple | list = ()) -> Any:
+        """Queue setting changes, return the result of the request that sent them."""
+        loop = self.hass.loop
+        future = loop.create_future()
+        self._pending.update(inputs)
+        self._refresh.update(refresh)
+        self._waiters.append(future)
+
+        # Debounce, but never hold changes back longer than the maximum delay
+        now = time.monotonic()
+        if self._first is None: self._first = now
+        if self._timer is not None: self._timer.cancel()
+        delay = min(WRITE_DEBOUNCE, max(0., self._first + WRITE_MAX_DELAY - now))
+        self._timer = loop.call_later(delay, lambda: self._create_task(self._async_flush()))
+
+        return await future
+
+    async def _async_flush(self) -> None:
+        """Send every pending change in a single request."""
+        inputs, self._pending = self._pending, {}
+        refresh, self._refresh = self._refresh, set()
+        waiters, self._waiters = self._waiters, []
+        self._first = self._timer = None
+        if not inputs: return None
+
+        async with self._lock:
+            try:
+                result = await self._get_api()._client.set_from_dict(inputs=inputs)
+            except asyncio.CancelledError:
+                self._fail(waiters, Exception("Inverter unloaded while the change was sent"))
+                raise
+            except Exception as e:
+                self._fail(waiters, e)
+                return None
+
+        _LOGGER.debug(f"Sent {inputs} for {len(waiters)} call(s): {result}")
+        for waiter in waiters:
+            if not waiter.done(): waiter.set_result(result)
+
+        # Read back what changed without waiting for the next poll
+        if refresh and self._on_written is not None:
+            self._create_task(self._on_written(refresh))
+
+    @callback
+    def async_close(self) -> None:
+        """Drop the changes not sent yet, their callers get an error (running requests are cancelled by the owner)."""
+        if self._timer is not None: self._timer.cancel()
+        waiters, self._waiters = self._waiters, []
+        self._pending, self._refresh = {}, set()
+        self._first = self._timer = None
+        self._fail(waiters, Exception("Inverter unloaded before the change was sent"))
+
+    @staticmethod
+    def _fail(waiters: list, error: Exception) -> None:
+        """Give an error to every caller still waiting."""
+        for waiter in waiters:
+            if not waiter.done(): waiter.set_exception(error)